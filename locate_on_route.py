@@ -3,11 +3,15 @@
 
 import os
 import sys
-import json
 import math
 from shapely.geometry import Point, LineString
 from shapely.ops import nearest_points
 
+try:
+    import orjson as _json  # Szybszy parser JSON (opcjonalny)
+except ImportError:
+    import json as _json
+
 def haversine_distance(coord1, coord2):
     """Oblicza odległość między dwoma punktami na powierzchni Ziemi w metrach."""
     # Sprawdź poprawność współrzędnych
@@ -118,13 +122,13 @@ def build_route_line(route_data):
 def load_data(route_file, stops_file=None):
     """Ładuje dane trasy i przystanków z plików JSON."""
     try:
-        with open(route_file, 'r', encoding='utf-8') as f:
-            route_data = json.load(f)
+        with open(route_file, 'rb') as f:
+            route_data = _json.loads(f.read())
         
         stops_data = []
         if stops_file and os.path.exists(stops_file):
-            with open(stops_file, 'r', encoding='utf-8') as f:
-                stops_data = json.load(f)
+            with open(stops_file, 'rb') as f:
+                stops_data = _json.loads(f.read())
             
             # Sprawdź, czy to może być summary.txt zamiast pliku JSON z przystankami
             if isinstance(stops_data, dict) and "features" not in stops_data:
@@ -134,7 +138,7 @@ def load_data(route_file, stops_file=None):
                     try:
                         print(f"Próba załadowania danych o przystankach z pliku {summary_file}")
                         with open(summary_file, 'r', encoding='utf-8') as f:
-                            summary_data = f.readlines()
+                            summary_data = f.read().splitlines()
                         
                         # Próba wyodrębnienia informacji o przystankach z pliku summary
                         stops_from_summary = []
@@ -142,7 +146,6 @@ def load_data(route_file, stops_file=None):
                         current_stop = {}
                         
                         for line in summary_data:
-                            line = line.strip()
                             if "Przystanki" in line:
                                 in_stops_section = True
                                 continue
@@ -233,7 +236,7 @@ def load_data(route_file, stops_file=None):
     except FileNotFoundError:
         print(f"Błąd: Nie znaleziono pliku {route_file} lub {stops_file}")
         raise
-    except json.JSONDecodeError:
+    except _json.JSONDecodeError:
         print(f"Błąd: Niepoprawny format JSON w pliku {route_file} lub {stops_file}")
         raise
     except Exception as e:
@@ -523,7 +526,7 @@ def get_route_total_length(route_file):
         summary_file = route_file.replace("_ways_ordered.json", "_summary.txt")
         if os.path.exists(summary_file):
             with open(summary_file, 'r', encoding='utf-8') as f:
-                summary_data = f.readlines()
+                summary_data = f.read().splitlines()
             
             for line in summary_data:
                 if "Całkowita długość trasy:" in line:
@@ -2,34 +2,310 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
 import sys
 import json
 import math
 import time
+import mmap
+import bisect
+import gzip
+import shelve
+import hashlib
 import asyncio
 import argparse
+import string
+import functools
+import concurrent.futures
+import collections
 import websockets
-from datetime import datetime
-from shapely.geometry import Point, LineString
-from shapely.ops import nearest_points
-import folium
-import webbrowser
-import threading
-from branca.element import Figure
+import numpy as np
+from typing import NamedTuple, Optional
+from shapely.geometry import LineString
+
+try:
+    import orjson as _json  # Szybszy parser JSON (opcjonalny)
+except ImportError:
+    import json as _json
+
+try:
+    import uvloop  # Szybsza pętla zdarzeń asyncio oparta na libuv (opcjonalna)
+except ImportError:
+    uvloop = None
+
+try:
+    import numba  # Kompilacja JIT jądra rzutowania punktu na trasę (opcjonalna)
+except ImportError:
+    numba = None
+
+# Wzorce do odczytu danych z pliku summary.txt (bajtowe - przeszukują zmapowany plik bez dekodowania)
+_STOP_RE = re.compile(r"Stop ID:\s*(?P<id>\S+)[^\n]*\n\s*Odległość od początku trasy:\s*(?P<dist>[\d.]+)".encode("utf-8"))
+_TOTAL_LENGTH_RE = re.compile(r"Całkowita długość trasy:\s*([\d.]+)".encode("utf-8"))
+_STOPS_SECTION = "Przystanki".encode("utf-8")
+
+def _map_file(f):
+    """Mapuje otwarty plik do pamięci tylko do odczytu (pusty plik nie może zostać zmapowany - zwraca b"")."""
+    if os.fstat(f.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+@functools.lru_cache(maxsize=128)
+def _summary_length(path, mtime):
+    """Odczytuje całkowitą długość trasy z pliku summary.txt (mtime w kluczu unieważnia wynik po zmianie pliku)."""
+    with open(path, 'rb') as f:
+        summary = _map_file(f)
+        try:
+            match = _TOTAL_LENGTH_RE.search(summary)
+            if match:
+                try:
+                    return float(match.group(1))
+                except ValueError:
+                    pass
+            return None
+        finally:
+            if summary:
+                summary.close()
+
+@functools.lru_cache(maxsize=128)
+def _summary_stops(path, mtime):
+    """
+    Odczytuje przystanki z sekcji "Przystanki" pliku summary.txt.
+    Zwraca krotkę par (id, odległość od początku trasy lub None) - niezmienną, bo jest współdzielona przez pamięć podręczną.
+    """
+    stops = []
+    with open(path, 'rb') as f:
+        summary = _map_file(f)
+        try:
+            stops_section = summary.find(_STOPS_SECTION)
+            if stops_section >= 0:
+                for match in _STOP_RE.finditer(summary, stops_section):
+                    stop_id = match.group("id").decode("utf-8")
+                    try:
+                        stops.append((stop_id, float(match.group("dist"))))
+                    except ValueError:
+                        stops.append((stop_id, None))
+        finally:
+            if summary:
+                summary.close()
+    return tuple(stops)
+
+_EARTH_RADIUS_M = 6371000.0  # Promień Ziemi w metrach
+_D2R = math.pi / 180.0  # Mnożnik zamiany stopni na radiany
+
+def _equirect_m(lon1, lat1, lon2, lat2, cos_lat0):
+    """
+    Przybliżona odległość w metrach (rzut równoodległościowy przy szerokości o cosinusie cos_lat0).
+    Dla odległości rzędu kilku kilometrów wystarczająco dokładna, a nie wymaga asin/sqrt z haversine.
+    """
+    return _EARTH_RADIUS_M * _D2R * math.hypot((lon2 - lon1) * cos_lat0, lat2 - lat1)
+
+def _haversine_m(lon1, lat1, lon2, lat2, _sin=math.sin, _cos=math.cos, _asin=math.asin, _sqrt=math.sqrt):
+    """Odległość (w metrach) między dwoma punktami podanymi w stopniach; funkcje math związane jako argumenty domyślne."""
+    lat1 *= _D2R
+    lat2 *= _D2R
+    s_dlat = _sin((lat2 - lat1) * 0.5)
+    s_dlon = _sin((lon2 - lon1) * (_D2R * 0.5))
+    return 2 * _EARTH_RADIUS_M * _asin(_sqrt(s_dlat * s_dlat + _cos(lat1) * _cos(lat2) * s_dlon * s_dlon))
+
+def _haversine_edges(lon_r, lat_r, cos_lat):
+    """
+    Oblicza długości (w metrach) kolejnych odcinków łamanej.
+    Przyjmuje tablice współrzędnych węzłów w radianach oraz cos(lat) policzony raz dla każdego węzła.
+    """
+    sin_dlat = np.sin(np.diff(lat_r) * 0.5)
+    sin_dlon = np.sin(np.diff(lon_r) * 0.5)
+    a = sin_dlat * sin_dlat + cos_lat[:-1] * cos_lat[1:] * sin_dlon * sin_dlon
+    return 2 * _EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+def _haversine_edges_loop(lon_r, lat_r, cos_lat):
+    """Wersja _haversine_edges liczona w jednej pętli, bez tablic pośrednich (do kompilacji przez numbę)."""
+    out = np.empty(lon_r.shape[0] - 1)
+    for i in range(out.shape[0]):
+        sin_dlat = math.sin((lat_r[i + 1] - lat_r[i]) * 0.5)
+        sin_dlon = math.sin((lon_r[i + 1] - lon_r[i]) * 0.5)
+        a = sin_dlat * sin_dlat + cos_lat[i] * cos_lat[i + 1] * sin_dlon * sin_dlon
+        out[i] = 2 * _EARTH_RADIUS_M * math.asin(math.sqrt(a))
+    return out
+
+def _polyline_edges(coords):
+    """
+    Oblicza długości (w metrach) odcinków łamanej o węzłach (lon, lat) w tablicy (n, 2).
+    Odcinek z niepoprawnym końcem (NaN, np. z brakującej współrzędnej) ma długość 0.
+    """
+    lat_r = np.radians(coords[:, 1])
+    edges = _haversine_edges(np.radians(coords[:, 0]), lat_r, np.cos(lat_r))
+    finite = np.isfinite(coords).all(axis=1)
+    if not finite.all():
+        edges[~(finite[:-1] & finite[1:])] = 0.0
+    return edges
+
+_MORTON_BITS = 16  # Liczba bitów na współrzędną w indeksie z-order (siatka 65536 x 65536)
+_MORTON_MAX = (1 << _MORTON_BITS) - 1
+
+def _bearing_deg(lon1, lat1, lon2, lat2, _sin=math.sin, _cos=math.cos, _atan2=math.atan2):
+    """Azymut (w stopniach, 0-360) z punktu 1 do punktu 2 podanych w stopniach; funkcje math związane jako argumenty domyślne."""
+    lat1 *= _D2R
+    lat2 *= _D2R
+    dlon = (lon2 - lon1) * _D2R
+    cos_lat2 = _cos(lat2)
+    y = _sin(dlon) * cos_lat2
+    x = _cos(lat1) * _sin(lat2) - _sin(lat1) * cos_lat2 * _cos(dlon)
+    return (_atan2(y, x) / _D2R + 360) % 360
+
+def _bearings(lon1, lat1, lon2, lat2):
+    """Azymuty (w stopniach, 0-360) dla tablic par punktów podanych w stopniach - ten sam wzór co calculate_bearing."""
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    dlon = np.radians(lon2) - np.radians(lon1)
+    cos_lat2 = np.cos(lat2)
+    y = np.sin(dlon) * cos_lat2
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * cos_lat2 * np.cos(dlon)
+    return (np.degrees(np.arctan2(y, x)) + 360) % 360
+
+# Kierunki świata co 45 stopni, od północy zgodnie z ruchem wskazówek zegara (indeks = round(azymut / 45) % 8)
+_CARDINAL_DIRECTIONS = ("północ", "północny wschód", "wschód", "południowy wschód",
+                        "południe", "południowy zachód", "zachód", "północny zachód")
+
+def _spread_bits(v):
+    """Rozsuwa 16 bitów liczby tak, aby zajmowały parzyste pozycje (0, 2, 4, ...)."""
+    v = np.asarray(v, dtype=np.uint32) & np.uint32(0xFFFF)
+    v = (v | (v << np.uint32(8))) & np.uint32(0x00FF00FF)
+    v = (v | (v << np.uint32(4))) & np.uint32(0x0F0F0F0F)
+    v = (v | (v << np.uint32(2))) & np.uint32(0x33333333)
+    v = (v | (v << np.uint32(1))) & np.uint32(0x55555555)
+    return v
+
+def _morton(ix, iy):
+    """Koduje skwantowane współrzędne (ix, iy) jako wartość na krzywej z-order (przeplot bitów)."""
+    return _spread_bits(ix) | (_spread_bits(iy) << np.uint32(1))
+
+# Rozsunięte bity każdego bajtu - do kodowania pojedynczych punktów bez tworzenia tablic NumPy
+_SPREAD_BYTE = tuple(int(v) for v in _spread_bits(np.arange(256)))
+
+def _morton_scalar(ix, iy):
+    """Wersja _morton dla pojedynczej pary liczb całkowitych (zapytania o prostokąt przy każdej lokalizacji)."""
+    x = _SPREAD_BYTE[ix & 0xFF] | (_SPREAD_BYTE[ix >> 8] << 16)
+    y = _SPREAD_BYTE[iy & 0xFF] | (_SPREAD_BYTE[iy >> 8] << 16)
+    return x | (y << 1)
+
+def _nearest_segment(px, py, start, delta, len2, edges):
+    """
+    Rzutuje punkt (px, py) na odcinki o indeksach edges w jednym przebiegu, bez tablic pośrednich.
+    Zwraca (pozycja w edges, kwadrat odległości, t) dla najbliższego odcinka.
+    """
+    best_k = 0
+    best_d2 = -1.0
+    best_t = 0.0
+    for k in range(edges.shape[0]):
+        i = edges[k]
+        x = px - start[i, 0]
+        y = py - start[i, 1]
+        t = (x * delta[i, 0] + y * delta[i, 1]) / len2[i]
+        if t < 0.0:
+            t = 0.0
+        elif t > 1.0:
+            t = 1.0
+        dx = x - t * delta[i, 0]
+        dy = y - t * delta[i, 1]
+        d2 = dx * dx + dy * dy
+        if best_d2 < 0.0 or d2 < best_d2:
+            best_k = k
+            best_d2 = d2
+            best_t = t
+    return best_k, best_d2, best_t
+
+if numba is not None:
+    _nearest_segment = numba.njit(cache=True, fastmath=True, boundscheck=False)(_nearest_segment)
+    _haversine_edges = numba.njit(cache=True, fastmath=True, boundscheck=False)(_haversine_edges_loop)
+else:
+    # Bez numby pętla w Pythonie byłaby wolniejsza niż wersja NumPy - RouteTracker używa wtedy _project_edges
+    _nearest_segment = None
+
+def _is_vehicles_frame(message):
+    """
+    Wstępnie sprawdza (bez parsowania JSON), czy ramka z websocketa może zawierać temat vehicles_info.
+    Wyszukiwanie podciągu jest wielokrotnie tańsze niż parsowanie całej wiadomości tylko po to, by ją odrzucić.
+    """
+    if isinstance(message, str):
+        return '"vehicles_info"' in message
+    return b'"vehicles_info"' in message
+
+def _json_default(obj):
+    """Zamienia typy NumPy na typy wbudowane podczas serializacji standardowym modułem json."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Obiekt typu {type(obj).__name__} nie jest serializowalny do JSON")
+
+def _dumps_bytes(obj):
+    """
+    Serializuje obiekt do zwartego JSON w UTF-8 w postaci bajtów (przez orjson, jeśli jest dostępny).
+    Wynik standardowego modułu json ma ten sam format co wynik orjson (bez spacji po separatorach).
+    """
+    if hasattr(_json, "OPT_SERIALIZE_NUMPY"):
+        return _json.dumps(obj, option=_json.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+def _stop_from_geojson(coords, props):
+    """Tworzy rekord przystanku na podstawie współrzędnych i właściwości obiektu Point z GeoJSON."""
+    stop_data = {
+        "id": props.get("id", "unknown"),
+        "position": coords,
+        "role": props.get("role", "stop"),
+        "name": props.get("name", "Brak nazwy")
+    }
+    
+    # Sprawdź, czy są dodatkowe informacje o odległości
+    if "dist_from_start" in props:
+        stop_data["dist_from_start"] = props["dist_from_start"]
+    elif "distance_from_start" in props:
+        stop_data["dist_from_start"] = props["distance_from_start"]
+    
+    return stop_data
+
+class RouteWay(NamedTuple):
+    """Identyfikatory odcinka (way) trasy odczytane raz ze słownika z pliku trasy."""
+    id: str = ""
+    start_node: str = ""
+    end_node: str = ""
 
 class RouteTracker:
     """Klasa do śledzenia pozycji na trasie. Wczytuje dane raz i umożliwia wielokrotne lokalizowanie."""
     
-    def __init__(self, route_file, stops_file, verbose=False):
-        """Inicjalizacja z plikami trasy i przystanków."""
+    # Liczba odcinków po każdej stronie podpowiedzi sprawdzanych w poszukiwaniach lokalnych
+    HINT_WINDOW = 32
+    # Odległość od trasy (w metrach), powyżej której wynik poszukiwań lokalnych jest odrzucany
+    HINT_MAX_DISTANCE = 50.0
+    # Początkowy promień (w metrach) poszukiwań w indeksie z-order; podwajany, dopóki nie znajdzie się odcinek
+    INDEX_START_RADIUS = 25.0
+    # Maksymalna liczba wyników lokalizacji zapisywanych na dysku (po jej osiągnięciu nowe wyniki nie są dopisywane)
+    LOCATE_DISK_CACHE_MAX_ENTRIES = 100000
+    # Liczba nowych wyników zbieranych w pamięci przed jednym zapisem na dysk
+    LOCATE_DISK_CACHE_FLUSH = 64
+    
+    def __init__(self, route_file, stops_file, verbose=False, cache_dir=None):
+        """
+        Inicjalizacja z plikami trasy i przystanków.
+        Jeśli podano cache_dir, wyniki lokalizacji są zapamiętywane na dysku i dostępne po ponownym uruchomieniu.
+        """
         self.verbose = verbose
+        if not verbose:
+            # W trybie cichym print_info jest pustą funkcją - bez sprawdzania flagi przy każdym wywołaniu
+            self.print_info = lambda message: None
         self.print_info(f"Inicjalizacja RouteTracker z plikami: {route_file}, {stops_file}")
         
         # Wczytaj dane
         self.route_data, self.stops_data = self.load_data(route_file, stops_file)
+        self._ways = [RouteWay(way.get("id", ""), way.get("start_node", ""), way.get("end_node", "")) for way in self.route_data]
         
-        # Utwórz geometrię trasy
-        self.route_line, self.calculated_length = self.build_route_line(self.route_data)
+        # Utwórz geometrię trasy (lub odtwórz ją z pamięci podręcznej z poprzedniego uruchomienia)
+        route_cache_file = self.route_cache_path(cache_dir, route_file) if cache_dir else None
+        if not (route_cache_file and self.load_route_cache(route_cache_file)):
+            self.calculated_length = self.build_route_line(self.route_data)
+            self.build_way_index()
+            if route_cache_file:
+                self.save_route_cache(route_cache_file)
         
         # Spróbuj odczytać długość trasy z pliku summary
         self.summary_length = self.get_route_total_length(route_file)
@@ -37,10 +313,22 @@ class RouteTracker:
         # Użyj odczytanej długości, jeśli jest dostępna, w przeciwnym razie użyj obliczonej
         self.total_route_length = self.summary_length if self.summary_length else self.calculated_length
         
+        # Posortowane przystanki i ich odległości od początku trasy (potrzebna jest już długość trasy)
+        self.print_info(f"Liczba przystanków do sprawdzenia: {len(self.stops_data)}")
+        self._stops, self._stops_dist = self.build_stop_index()
+        
         self.print_info(f"Zbudowano linię trasy o długości {self.total_route_length:.2f} m")
         if self.summary_length:
             self.print_info(f"Uwaga: Użyto długości z pliku summary ({self.summary_length:.2f} m) zamiast obliczonej ({self.calculated_length:.2f} m)")
         
+        # Trwała pamięć wyników lokalizacji (opcjonalna)
+        self._disk_cache = self.open_locate_cache(cache_dir, route_file, stops_file) if cache_dir else None
+        self._disk_cache_size = len(self._disk_cache) if self._disk_cache is not None else 0
+        self._disk_cache_pending = {}  # Nowe wyniki czekające na zapis na dysk
+        
+        # Wskazówki nawigacyjne generowane raz, przy pierwszym initialize_navigation (None - jeszcze nie wygenerowano)
+        self._navigation_distances = None
+        
         self.ready = True
         self.print_info("RouteTracker gotowy do pracy.")
     
@@ -49,61 +337,125 @@ class RouteTracker:
         if self.verbose:
             print(f"[INFO] {message}")
     
+    def open_locate_cache(self, cache_dir, route_file, stops_file):
+        """
+        Otwiera plik z zapamiętanymi wynikami lokalizacji dla tej trasy.
+        Nazwa pliku zawiera skrót plików wejściowych, więc zmiana trasy, przystanków lub podsumowania tworzy nową pamięć.
+        """
+        try:
+            digest = hashlib.blake2b(digest_size=8)
+            summary_file = route_file.replace("_ways_ordered.json", "_summary.txt")
+            for path in (route_file, stops_file, summary_file):
+                if path and os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        digest.update(f.read())
+                digest.update(b"\0")
+            
+            os.makedirs(cache_dir, exist_ok=True)
+            cache_path = os.path.join(cache_dir, f".locate_cache.{digest.hexdigest()}")
+            self.print_info(f"Pamięć wyników lokalizacji: {cache_path}")
+            return shelve.open(cache_path)
+        except Exception as e:
+            print(f"Nie udało się otworzyć pamięci wyników lokalizacji: {e}")
+            return None
+    
+    def flush_locate_cache(self):
+        """Zapisuje na dysk zebrane w pamięci wyniki lokalizacji (do limitu LOCATE_DISK_CACHE_MAX_ENTRIES)."""
+        pending = self._disk_cache_pending
+        if self._disk_cache is None or not pending:
+            return
+        for key, result in pending.items():
+            if key not in self._disk_cache:
+                if self._disk_cache_size >= self.LOCATE_DISK_CACHE_MAX_ENTRIES:
+                    continue
+                self._disk_cache_size += 1
+            self._disk_cache[key] = result
+        pending.clear()
+    
+    def close(self):
+        """Zapisuje i zamyka pamięć wyników lokalizacji (jeśli jest używana)."""
+        if self._disk_cache is not None:
+            self.flush_locate_cache()
+            self._disk_cache.close()
+            self._disk_cache = None
+    
     def haversine_distance(self, coord1, coord2):
         """Oblicza odległość między dwoma punktami na powierzchni Ziemi w metrach."""
-        # Sprawdź poprawność współrzędnych
-        if not (isinstance(coord1, (list, tuple)) and isinstance(coord2, (list, tuple))):
+        try:
+            return _haversine_m(coord1[0], coord1[1], coord2[0], coord2[1])
+        except (TypeError, IndexError, KeyError, ValueError) as e:
+            # Niepoprawne współrzędne (brakujące lub nieliczbowe) - sprawdzane dopiero w razie błędu
+            self.print_info(f"Błąd podczas obliczania odległości: {e}")
             return 0
-        if len(coord1) < 2 or len(coord2) < 2:
+    
+    def polyline_length(self, points):
+        """Oblicza długość łamanej w metrach, licząc funkcje trygonometryczne tylko raz dla każdego węzła."""
+        if len(points) < 2:
             return 0
+        try:
+            coords = np.asarray(points, dtype=np.float64)[:, :2]
+        except (ValueError, TypeError, IndexError):
+            # Niejednorodne dane - licz odcinek po odcinku
+            return sum(self.haversine_distance(points[j], points[j+1]) for j in range(len(points) - 1))
         
+        return float(_polyline_edges(coords).sum())
+    
+    def cumulative_distances(self, points):
+        """Zwraca tablicę odległości (w metrach) od pierwszego punktu łamanej do każdego z jej punktów."""
+        if len(points) < 2:
+            return np.zeros(len(points))
         try:
-            lon1, lat1 = coord1
-            lon2, lat2 = coord2
-            
-            # Upewnij się, że współrzędne są liczbami
-            if not all(isinstance(x, (int, float)) for x in [lon1, lat1, lon2, lat2]):
-                return 0
-            
-            # Zamiana stopni na radiany
-            lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-            
-            # Wzór haversine'a
-            dlon = lon2 - lon1
-            dlat = lat2 - lat1
-            a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-            c = 2 * math.asin(math.sqrt(a))
-            r = 6371000  # Promień Ziemi w metrach
-            
-            return c * r
-        except Exception as e:
-            self.print_info(f"Błąd podczas obliczania odległości: {e}")
-            return 0
+            edges = _polyline_edges(np.asarray(points, dtype=np.float64)[:, :2])
+        except (ValueError, TypeError, IndexError):
+            # Niejednorodne dane - licz odcinek po odcinku
+            edges = [self.haversine_distance(points[j], points[j+1]) for j in range(len(points) - 1)]
+        return np.concatenate(([0.0], np.cumsum(edges)))
+    
+    def coords_array(self, points):
+        """
+        Zamienia listę punktów (lon, lat) na ciągłą tablicę float64 o kształcie (n, 2).
+        Z niejednorodnych danych zachowuje tylko punkty, które są parami liczb.
+        """
+        try:
+            coords = np.asarray(points, dtype=np.float64)
+            if coords.ndim == 2 and coords.shape[1] >= 2:
+                return np.ascontiguousarray(coords[:, :2])
+        except (ValueError, TypeError):
+            pass
+        
+        # Niejednorodne dane - odrzuć punkty, które nie są parami liczb
+        return np.asarray([
+            point[:2] for point in points
+            if isinstance(point, (list, tuple)) and len(point) >= 2
+            and isinstance(point[0], (int, float)) and isinstance(point[1], (int, float))
+        ], dtype=np.float64).reshape(-1, 2)
     
     def build_route_line(self, route_data):
-        """Buduje linię reprezentującą całą trasę."""
-        all_points = []
+        """Buduje tablice węzłów reprezentujące całą trasę i zwraca jej obliczoną długość."""
+        # Węzły każdego odcinka jako tablica (n, 2) - jeden ciągły bufor zamiast listy list
+        self._way_coords = [self.coords_array(way.get("nodes", [])) for way in route_data]
+        
+        way_arrays = []
+        last_point = None
         segment_lengths = []
         total_distance = 0
         
         for i, way in enumerate(route_data):
             # Zakładamy, że mamy listę węzłów (nodes) zawierającą punkty (lon, lat)
-            way_points = way.get("nodes", [])
-            if way_points:  # Upewnij się, że są jakieś punkty
-                if i > 0 and all_points and way_points and all_points[-1] == way_points[0]:
+            way_points = self._way_coords[i]
+            if len(way_points):  # Upewnij się, że są jakieś punkty
+                if last_point is not None and np.array_equal(last_point, way_points[0]):
                     # Jeśli ostatni punkt poprzedniego segmentu jest taki sam jak pierwszy punkt bieżącego,
-                    # pomijamy pierwszy punkt bieżącego, aby uniknąć duplikacji
+                    # pomijamy pierwszy punkt bieżącego, aby uniknąć duplikacji (widok, bez kopiowania)
                     way_points = way_points[1:]
                 
                 # Obliczamy długość segmentu
-                segment_length = 0
                 segment_start_dist = total_distance
-                for j in range(len(way_points) - 1):
-                    try:
-                        distance = self.haversine_distance(way_points[j], way_points[j+1])
-                        segment_length += distance
-                    except Exception as e:
-                        self.print_info(f"Błąd podczas obliczania odległości w segmencie {i}: {e}")
+                try:
+                    segment_length = self.polyline_length(way_points)
+                except Exception as e:
+                    segment_length = 0
+                    self.print_info(f"Błąd podczas obliczania odległości w segmencie {i}: {e}")
                 
                 total_distance += segment_length
                 segment_lengths.append({
@@ -114,58 +466,191 @@ class RouteTracker:
                     "length": segment_length
                 })
                 
-                all_points.extend(way_points)
+                if len(way_points):
+                    way_arrays.append(way_points)
+                    last_point = way_points[-1]
         
         # Wypisz informacje o segmentach
-        self.print_info("Informacje o segmentach trasy:")
-        for i, seg in enumerate(segment_lengths):
-            self.print_info(f"Segment {i+1} (ID: {seg['id']}): od {seg['start_distance']:.2f} m do {seg['end_distance']:.2f} m, długość: {seg['length']:.2f} m")
+        if self.verbose:
+            self.print_info("Informacje o segmentach trasy:")
+            for i, seg in enumerate(segment_lengths):
+                self.print_info(f"Segment {i+1} (ID: {seg['id']}): od {seg['start_distance']:.2f} m do {seg['end_distance']:.2f} m, długość: {seg['length']:.2f} m")
         
         self.print_info(f"Całkowita obliczona długość trasy: {total_distance:.2f} m")
         
+        coords = np.concatenate(way_arrays) if way_arrays else np.zeros((0, 2))
+        
         # Sprawdź, czy mamy wystarczającą liczbę punktów
-        if len(all_points) < 2:
+        if len(coords) < 2:
             raise ValueError("Niewystarczająca liczba punktów do stworzenia trasy")
         
-        # Sprawdź, czy punkty mają poprawne współrzędne
-        valid_points = []
-        for point in all_points:
-            if isinstance(point, (list, tuple)) and len(point) >= 2:
-                # Upewnij się, że współrzędne to liczby i nie są NaN
-                if (isinstance(point[0], (int, float)) and 
-                    isinstance(point[1], (int, float)) and
-                    not (math.isnan(point[0]) or math.isnan(point[1]))):
-                    valid_points.append(point)
-        
-        if len(valid_points) < 2:
-            raise ValueError("Niewystarczająca liczba poprawnych punktów do stworzenia trasy")
+        # Sprawdź, czy punkty mają poprawne współrzędne (liczby skończone, nie NaN)
+        coords = coords[np.isfinite(coords).all(axis=1)]
         
-        # Usuń potencjalnie zduplikowane punkty
-        unique_points = []
-        prev_point = None
-        for point in valid_points:
-            if prev_point is None or point != prev_point:
-                unique_points.append(point)
-                prev_point = point
+        if len(coords) < 2:
+            raise ValueError("Niewystarczająca liczba poprawnych punktów do stworzenia trasy")
         
-        self.print_info(f"Zbudowano trasę złożoną z {len(unique_points)} punktów")
+        # Usuń zduplikowane kolejne punkty (jedna maska zamiast porównywania punkt po punkcie)
+        keep = np.concatenate(([True], np.any(coords[1:] != coords[:-1], axis=1)))
+        route_coords = coords[keep]
         
-        # Utwórz geometrię trasy
-        route_line = LineString(unique_points)
+        self.print_info(f"Zbudowano trasę złożoną z {len(route_coords)} punktów")
         
-        # Zwróć zarówno linię jak i obliczoną długość
-        return route_line, total_distance
+        # Przygotuj tablice trasy i zwróć obliczoną długość
+        self.set_route_coords(route_coords)
+        return total_distance
+    
+    def set_route_coords(self, route_coords):
+        """Przygotowuje tablice potrzebne do lokalizacji na trasie o podanych węzłach."""
+        self._coords_np = route_coords
+        
+        # Przelicz współrzędne węzłów na radiany i cos(lat) raz, a następnie długości wszystkich odcinków trasy
+        lon_r = np.radians(route_coords[:, 0])
+        lat_r = np.radians(route_coords[:, 1])
+        self._edge_lengths = _haversine_edges(lon_r, lat_r, np.cos(lat_r))
+        # Odległość od początku trasy do każdego węzła (odcinek i zaczyna się w _cum_dist[i])
+        self._cum_dist = np.concatenate(([0.0], np.cumsum(self._edge_lengths)))
+        # Cosinus mediany szerokości węzłów trasy dla przybliżenia równoodległościowego
+        # (mediana nie przesuwa się w stronę zagęszczonych węzłów na jednym końcu trasy)
+        self._cos_lat0 = math.cos(float(np.median(lat_r)))
+        
+        # Odcinki we współrzędnych płaskich (lon * cos_lat0, lat) do wektorowego rzutowania punktu na trasę.
+        # Przechowywane jako float32 względem pierwszego węzła - przesunięcia są małe, więc dokładność
+        # wynosi kilka milimetrów, a wyszukiwanie przenosi o połowę mniej danych; odległość od początku
+        # trasy liczona jest dalej w float64 z _cum_dist i _edge_lengths
+        flat = route_coords * np.array((self._cos_lat0, 1.0))
+        self._flat_origin = flat[0].copy()
+        flat -= self._flat_origin
+        delta = np.diff(flat, axis=0)
+        self._seg_start = flat[:-1].astype(np.float32)
+        self._seg_delta = delta.astype(np.float32)
+        self._seg_len2 = (delta * delta).sum(axis=1).astype(np.float32)
+        
+        self.build_segment_index(route_coords)
+        
+        if _nearest_segment is not None:
+            # Rozgrzej JIT teraz, aby kompilacja nie opóźniła pierwszej lokalizacji
+            self._nearest_among(route_coords[0], slice(0, 1))
+    
+    def route_cache_path(self, cache_dir, route_file):
+        """Zwraca ścieżkę pliku z zapisaną geometrią trasy - nazwa zależy od ścieżki, czasu modyfikacji i rozmiaru pliku trasy."""
+        stat = os.stat(route_file)
+        key = f"{os.path.abspath(route_file)}:{stat.st_mtime_ns}:{stat.st_size}"
+        return os.path.join(cache_dir, f".route_cache.{hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()}.npz")
+    
+    def load_route_cache(self, path):
+        """Odtwarza geometrię trasy i tabelę odcinków z pliku. Zwraca False, jeśli pliku nie ma lub jest nieczytelny."""
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                route_coords = data["coords"]
+                calculated_length = float(data["calculated_length"])
+                way_indices = data["way_indices"].tolist()
+                way_lengths = data["way_lengths"].tolist()
+        except Exception as e:
+            self.print_info(f"Nie udało się wczytać zapisanej geometrii trasy: {e}")
+            return False
+        
+        self.set_route_coords(route_coords)
+        self.calculated_length = calculated_length
+        self.set_way_index(way_indices, way_lengths)
+        self.print_info(f"Wczytano zapisaną geometrię trasy z pliku {path}")
+        return True
+    
+    def save_route_cache(self, path):
+        """Zapisuje geometrię trasy i tabelę odcinków, aby kolejne uruchomienie nie musiało ich liczyć."""
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp.npz"
+            np.savez(
+                tmp_path,
+                coords=self._coords_np,
+                calculated_length=self.calculated_length,
+                way_indices=np.asarray(self._way_indices, dtype=np.int64),
+                way_lengths=np.asarray(self._way_lengths, dtype=np.float64)
+            )
+            # Podmiana pliku w jednym kroku - inny proces nie odczyta niepełnego zapisu
+            os.replace(tmp_path, path)
+        except Exception as e:
+            self.print_info(f"Nie udało się zapisać geometrii trasy: {e}")
+    
+    def build_segment_index(self, route_coords):
+        """
+        Buduje indeks przestrzenny odcinków trasy: środki odcinków posortowane według wartości z-order (Morton).
+        Prostokąt wokół punktu odpowiada wtedy ciągłemu przedziałowi posortowanej tablicy.
+        """
+        starts = route_coords[:-1]
+        ends = route_coords[1:]
+        centroids = (starts + ends) * 0.5
+        
+        # Największe odchylenie dowolnego punktu odcinka od jego środka (w stopniach, osobno dla każdej osi)
+        self._half_extent = np.abs(ends - starts).max(axis=0) * 0.5
+        
+        # Kwantyzacja środków odcinków na siatkę obejmującą trasę
+        self._grid_min = route_coords.min(axis=0)
+        span = route_coords.max(axis=0) - self._grid_min
+        self._grid_scale = _MORTON_MAX / np.where(span > 0, span, 1.0)
+        cells = self._grid_cells(centroids)
+        zvals = _morton(cells[:, 0], cells[:, 1])
+        
+        self._zorder = np.argsort(zvals, kind="stable")
+        self._zvals = zvals[self._zorder]
+        self._centroid_lon_z = np.ascontiguousarray(centroids[self._zorder, 0])
+        self._centroid_lat_z = np.ascontiguousarray(centroids[self._zorder, 1])
+        
+        # Parametry siatki jako liczby Pythona - zapytanie dotyczy jednego prostokąta, więc tablice tylko by spowalniały
+        self._grid_lon0, self._grid_lat0 = (float(v) for v in self._grid_min)
+        self._grid_lon_scale, self._grid_lat_scale = (float(v) for v in self._grid_scale)
+        self._half_lon, self._half_lat = (float(v) for v in self._half_extent)
+    
+    def _grid_cells(self, points):
+        """Zamienia współrzędne (lon, lat) na numery komórek siatki indeksu z-order."""
+        cells = np.floor((np.asarray(points, dtype=np.float64) - self._grid_min) * self._grid_scale)
+        return np.clip(cells, 0, _MORTON_MAX).astype(np.uint32)
+    
+    def _index_candidates(self, location, radius_m):
+        """
+        Zwraca indeksy odcinków, które mogą mieć punkt w odległości radius_m od lokalizacji.
+        Prostokąt wokół lokalizacji jest powiększony o połowę najdłuższego odcinka, bo indeks zawiera środki odcinków.
+        """
+        dlat = radius_m / (_EARTH_RADIUS_M * _D2R)
+        delta_lon = dlat / self._cos_lat0 + self._half_lon
+        delta_lat = dlat + self._half_lat
+        lon, lat = float(location[0]), float(location[1])
+        low_lon, high_lon = lon - delta_lon, lon + delta_lon
+        low_lat, high_lat = lat - delta_lat, lat + delta_lat
+        
+        # Wszystkie punkty prostokąta mają wartość z pomiędzy z(lewy dolny róg) i z(prawy górny róg)
+        zmin = _morton_scalar(self._lon_cell(low_lon), self._lat_cell(low_lat))
+        zmax = _morton_scalar(self._lon_cell(high_lon), self._lat_cell(high_lat))
+        lo = int(self._zvals.searchsorted(zmin, side="left"))
+        hi = int(self._zvals.searchsorted(zmax, side="right"))
+        
+        # Przedział krzywej z-order wychodzi poza prostokąt - odrzuć środki, które w nim nie leżą
+        c_lon = self._centroid_lon_z[lo:hi]
+        c_lat = self._centroid_lat_z[lo:hi]
+        inside = (c_lon >= low_lon) & (c_lon <= high_lon) & (c_lat >= low_lat) & (c_lat <= high_lat)
+        return self._zorder[lo:hi][inside]
+    
+    def _lon_cell(self, lon):
+        """Numer kolumny siatki indeksu z-order dla długości geograficznej (obcięty do zakresu siatki)."""
+        return min(max(math.floor((lon - self._grid_lon0) * self._grid_lon_scale), 0), _MORTON_MAX)
+    
+    def _lat_cell(self, lat):
+        """Numer wiersza siatki indeksu z-order dla szerokości geograficznej (obcięty do zakresu siatki)."""
+        return min(max(math.floor((lat - self._grid_lat0) * self._grid_lat_scale), 0), _MORTON_MAX)
     
     def load_data(self, route_file, stops_file=None):
         """Ładuje dane trasy i przystanków z plików JSON."""
         try:
-            with open(route_file, 'r', encoding='utf-8') as f:
-                route_data = json.load(f)
+            with open(route_file, 'rb') as f:
+                route_data = _json.loads(f.read())
             
             stops_data = []
             if stops_file and os.path.exists(stops_file):
-                with open(stops_file, 'r', encoding='utf-8') as f:
-                    stops_data = json.load(f)
+                with open(stops_file, 'rb') as f:
+                    stops_data = _json.loads(f.read())
                 
                 # Sprawdź, czy to może być summary.txt zamiast pliku JSON z przystankami
                 if isinstance(stops_data, dict) and "features" not in stops_data:
@@ -174,40 +659,12 @@ class RouteTracker:
                     if os.path.exists(summary_file):
                         try:
                             self.print_info(f"Próba załadowania danych o przystankach z pliku {summary_file}")
-                            with open(summary_file, 'r', encoding='utf-8') as f:
-                                summary_data = f.readlines()
                             
-                            # Próba wyodrębnienia informacji o przystankach z pliku summary
-                            stops_from_summary = []
-                            in_stops_section = False
-                            current_stop = {}
-                            
-                            for line in summary_data:
-                                line = line.strip()
-                                if "Przystanki" in line:
-                                    in_stops_section = True
-                                    continue
-                                
-                                if in_stops_section and line.startswith("Stop ID:"):
-                                    if current_stop:
-                                        stops_from_summary.append(current_stop)
-                                    current_stop = {}
-                                    parts = line.split(":")
-                                    if len(parts) > 1:
-                                        current_stop["id"] = parts[1].strip()
-                                
-                                elif in_stops_section and "Odległość od początku trasy:" in line:
-                                    parts = line.split(":")
-                                    if len(parts) > 1:
-                                        dist_part = parts[1].strip()
-                                        dist_value = dist_part.split(" ")[0]  # Bierz tylko liczbę
-                                        try:
-                                            current_stop["dist_from_start"] = float(dist_value)
-                                        except ValueError:
-                                            pass
-                            
-                            if current_stop:
-                                stops_from_summary.append(current_stop)
+                            # Wyodrębnij informacje o przystankach z sekcji "Przystanki" pliku summary
+                            stops_from_summary = [
+                                {"id": stop_id, "dist_from_start": dist} if dist is not None else {"id": stop_id}
+                                for stop_id, dist in _summary_stops(summary_file, os.stat(summary_file).st_mtime_ns)
+                            ]
                             
                             if stops_from_summary:
                                 self.print_info(f"Znaleziono {len(stops_from_summary)} przystanków w pliku summary")
@@ -242,28 +699,15 @@ class RouteTracker:
                 # Sprawdź, czy mamy obiekt z kluczem "features" (format GeoJSON)
                 if isinstance(stops_data, dict) and "features" in stops_data:
                     self.print_info("Wykryto format GeoJSON dla przystanków, próbuję wyodrębnić dane...")
-                    features = stops_data.get("features", [])
-                    extracted_stops = []
-                    for feature in features:
-                        if feature.get("geometry", {}).get("type") == "Point":
-                            coords = feature.get("geometry", {}).get("coordinates", [])
-                            props = feature.get("properties", {})
-                            if coords:
-                                stop_data = {
-                                    "id": props.get("id", "unknown"),
-                                    "position": coords,
-                                    "role": props.get("role", "stop"),
-                                    "name": props.get("name", "Brak nazwy")  # Dodajemy nazwę przystanku
-                                }
-                                
-                                # Sprawdź, czy są dodatkowe informacje o odległości
-                                if "dist_from_start" in props:
-                                    stop_data["dist_from_start"] = props["dist_from_start"]
-                                elif "distance_from_start" in props:
-                                    stop_data["dist_from_start"] = props["distance_from_start"]
-                                
-                                extracted_stops.append(stop_data)
-                    stops_data = extracted_stops
+                    point_geometries = [
+                        (feature.get("geometry") or {}, feature.get("properties") or {})
+                        for feature in stops_data.get("features", [])
+                    ]
+                    stops_data = [
+                        _stop_from_geojson(geometry["coordinates"], props)
+                        for geometry, props in point_geometries
+                        if geometry.get("type") == "Point" and geometry.get("coordinates")
+                    ]
                     self.print_info(f"Wyodrębniono {len(stops_data)} przystanków z GeoJSON")
             
             # Wyświetl informacje o trasie i przystankach
@@ -274,71 +718,134 @@ class RouteTracker:
         except FileNotFoundError:
             print(f"Błąd: Nie znaleziono pliku {route_file} lub {stops_file}")
             raise
-        except json.JSONDecodeError:
+        except _json.JSONDecodeError:
             print(f"Błąd: Niepoprawny format JSON w pliku {route_file} lub {stops_file}")
             raise
         except Exception as e:
             print(f"Błąd podczas ładowania danych: {e}")
             raise
 
-    def find_location_on_route(self, location):
-        """Znajduje najbliższy punkt na trasie do podanej lokalizacji."""
+    def _project_edges(self, location, edges):
+        """
+        Rzutuje punkt na wybrane odcinki trasy jednocześnie (edges: wycinek lub tablica indeksów).
+        Zwraca tablice odległości w metrach (przybliżenie równoodległościowe) i parametrów t (0 - początek, 1 - koniec odcinka).
+        """
+        start = self._seg_start[edges]
+        delta = self._seg_delta[edges]
+        
+        # Rzut prostopadły na odcinek w płaskich współrzędnych, obcięty do jego końców
+        x = np.float32(location[0] * self._cos_lat0 - self._flat_origin[0]) - start[:, 0]
+        y = np.float32(location[1] - self._flat_origin[1]) - start[:, 1]
+        t = np.clip((x * delta[:, 0] + y * delta[:, 1]) / self._seg_len2[edges], np.float32(0.0), np.float32(1.0))
+        dx = x - t * delta[:, 0]
+        dy = y - t * delta[:, 1]
+        return _EARTH_RADIUS_M * _D2R * np.sqrt(dx * dx + dy * dy), t
+    
+    def _nearest_among(self, location, edges):
+        """Zwraca (indeks odcinka, odległość przybliżona, t) dla najbliższego z podanych odcinków."""
+        if _nearest_segment is not None:
+            if isinstance(edges, slice):
+                edges = np.arange(edges.start, edges.stop)
+            k, d2, t = _nearest_segment(float(location[0]) * self._cos_lat0 - self._flat_origin[0],
+                                        float(location[1]) - self._flat_origin[1],
+                                        self._seg_start, self._seg_delta, self._seg_len2, edges)
+            return k, _EARTH_RADIUS_M * _D2R * math.sqrt(d2), t
+        
+        dist, t = self._project_edges(location, edges)
+        k = int(np.argmin(dist))
+        return k, float(dist[k]), float(t[k])
+    
+    def _nearest_edge_near(self, location, hint):
+        """
+        Szuka najbliższego odcinka w oknie HINT_WINDOW odcinków po obu stronach odcinka hint.
+        Zwraca None, jeśli wynik nie jest pewny (najbliższy odcinek leży na brzegu okna lub zbyt daleko).
+        """
+        edge_count = len(self._edge_lengths)
+        hint = min(max(int(hint), 0), edge_count - 1)
+        lo = max(hint - self.HINT_WINDOW, 0)
+        hi = min(hint + self.HINT_WINDOW + 1, edge_count)
+        
+        k, dist, t = self._nearest_among(location, slice(lo, hi))
+        edge_index = lo + k
+        if dist > self.HINT_MAX_DISTANCE:
+            # Pojazd przeskoczył (lub błąd GPS)
+            return None
+        if (edge_index == lo and lo > 0) or (edge_index == hi - 1 and hi < edge_count):
+            # Odległość mogłaby dalej maleć poza oknem
+            return None
+        return edge_index, dist, t
+    
+    def result_matches_hint(self, result, hint):
+        """
+        Sprawdza, czy zapamiętany wynik lokalizacji leży w oknie HINT_WINDOW wokół odcinka hint.
+        Na trasie przechodzącej dwa razy przez ten sam punkt (tam i z powrotem, pętla) chroni
+        przed zwróceniem wyniku z drugiego przejazdu.
+        """
+        if hint is None:
+            return True
+        edge_index = result.get("edge_index")
+        return edge_index is not None and abs(edge_index - hint) <= self.HINT_WINDOW
+    
+    def _nearest_edge(self, location):
+        """
+        Szuka najbliższego odcinka przy pomocy indeksu z-order.
+        Wynik jest pewny, gdy najbliższy znaleziony punkt leży w promieniu poszukiwań (żaden odcinek spoza
+        prostokąta nie może być bliżej). Jeśli leży dalej, jego odległość wyznacza promień, który na pewno
+        wystarczy - wystarczają więc co najwyżej dwa zapytania po znalezieniu pierwszego kandydata.
+        """
+        edge_count = len(self._edge_lengths)
+        radius = self.INDEX_START_RADIUS
+        while True:
+            candidates = self._index_candidates(location, radius)
+            if len(candidates):
+                k, dist, t = self._nearest_among(location, candidates)
+                if dist <= radius or len(candidates) == edge_count:
+                    return int(candidates[k]), dist, t
+                # Niewielki zapas na błędy zaokrągleń przy ponownym liczeniu tej samej odległości
+                radius = dist * 1.000001
+            else:
+                radius *= 4
+    
+    def find_location_on_route(self, location, hint=None):
+        """
+        Znajduje najbliższy punkt na trasie do podanej lokalizacji.
+        
+        Args:
+            location: Lokalizacja (lon, lat)
+            hint: Indeks odcinka trasy z poprzedniej lokalizacji; pojazd porusza się w sposób ciągły,
+                  więc poszukiwania zaczynają się w jego pobliżu, a pełne przeszukanie jest wykonywane
+                  tylko, gdy najbliższy punkt w okolicy jest dalej niż HINT_MAX_DISTANCE
+        """
         try:
-            location_point = Point(location)
-            
-            # Sprawdź, czy geometria trasy jest poprawna
-            if not self.route_line.is_valid:
-                self.print_info("Ostrzeżenie: Geometria trasy jest niepoprawna. Próba naprawy...")
-                route_line = self.route_line.buffer(0)  # Próba naprawy geometrii
-                
-                if not route_line.is_valid:
-                    raise ValueError("Nie można naprawić geometrii trasy")
-            
-            # Zamiast używać nearest_points, które może nie działać poprawnie,
-            # obliczmy odległość do każdego segmentu trasy ręcznie
-            min_distance = float('inf')
-            nearest_point = None
-            nearest_segment_distance = 0
-            total_distance = 0
-            
-            coords = list(self.route_line.coords)
-            
-            for i in range(len(coords) - 1):
-                # Utwórz segment
-                segment = LineString([coords[i], coords[i+1]])
-                segment_length = self.haversine_distance(coords[i], coords[i+1])
-                
-                # Znajdź najbliższy punkt na segmencie
-                p = nearest_points(location_point, segment)[1]
-                
-                # Oblicz odległość
-                dist = location_point.distance(p)
-                
-                # Jeśli to najbliższy segment, zapisz informacje
-                if dist < min_distance:
-                    min_distance = dist
-                    nearest_point = p
-                    # Oblicz odległość od początku trasy do tego punktu
-                    nearest_segment_distance = total_distance + segment.project(p, normalized=True) * segment_length
-                
-                # Dodaj długość segmentu do całkowitej odległości
-                total_distance += segment_length
+            # Zamiast używać nearest_points dla całej trasy, które może nie działać poprawnie,
+            # obliczmy odległość do segmentów trasy ręcznie (wektorowo, dla wielu odcinków naraz)
+            best = None
+            if hint is not None:
+                best = self._nearest_edge_near(location, hint)
+            if best is None:
+                # Brak podpowiedzi lub niepewny wynik lokalny - przeszukaj całą trasę
+                best = self._nearest_edge(location)
             
-            if nearest_point is None:
-                raise ValueError("Nie znaleziono najbliższego punktu na trasie")
+            edge_index, _, t = best
+            coords = self._coords_np
+            nearest_point = coords[edge_index] + t * (coords[edge_index + 1] - coords[edge_index])
+            nearest_point = (float(nearest_point[0]), float(nearest_point[1]))
+            nearest_segment_distance = float(self._cum_dist[edge_index] + t * self._edge_lengths[edge_index])
             
-            # Oblicz odległość punktu od trasy w metrach
-            # Konwersja przybliżona: 1 stopień ≈ 111 km na równiku
-            distance_to_route_m = min_distance * 111000
+            # Oblicz dokładną odległość punktu od trasy w metrach (tylko dla zwycięskiego segmentu)
+            distance_to_route_m = self.haversine_distance(location, nearest_point)
             
-            self.print_info(f"Znaleziono najbliższy punkt: {nearest_point.x}, {nearest_point.y}")
-            self.print_info(f"Odległość od początku trasy: {nearest_segment_distance} m")
-            self.print_info(f"Odległość od trasy: {distance_to_route_m} m")
+            if self.verbose:
+                # Komunikaty formatowane tylko w trybie gadatliwym - ta metoda jest wywoływana dla każdej pozycji
+                self.print_info(f"Znaleziono najbliższy punkt: {nearest_point[0]}, {nearest_point[1]}")
+                self.print_info(f"Odległość od początku trasy: {nearest_segment_distance} m")
+                self.print_info(f"Odległość od trasy: {distance_to_route_m} m")
             
             return {
-                "nearest_point": (nearest_point.x, nearest_point.y),
+                "nearest_point": nearest_point,
                 "distance_from_start": nearest_segment_distance,
-                "distance_to_route": distance_to_route_m
+                "distance_to_route": distance_to_route_m,
+                "edge_index": edge_index
             }
         except Exception as e:
             self.print_info(f"Błąd podczas lokalizacji punktu na trasie: {e}")
@@ -347,22 +854,22 @@ class RouteTracker:
                 "nearest_point": location,
                 "distance_from_start": 0,
                 "distance_to_route": 0,
+                "edge_index": None,
                 "error": str(e)
             }
 
-    def find_nearest_stops(self, current_position, current_distance):
-        """Znajduje najbliższy poprzedni i następny przystanek."""
-        previous_stop = None
-        next_stop = None
+    def distance_along_route(self, location):
+        """Zwraca odległość (w metrach, wzdłuż trasy) od początku trasy do rzutu punktu (lon, lat) na trasę."""
+        edge_index, _, t = self._nearest_edge(location)
+        return float(self._cum_dist[edge_index] + t * self._edge_lengths[edge_index])
+    
+    def build_stop_index(self):
+        """
+        Oblicza odległości przystanków od początku trasy i sortuje je - raz, bo nie zależą od pozycji pojazdu.
+        Zwraca (posortowane przystanki, lista ich odległości od początku trasy).
+        """
         stops_data = self.stops_data
         
-        if not stops_data:
-            self.print_info("Brak danych o przystankach")
-            return previous_stop, next_stop
-        
-        self.print_info(f"Szukanie przystanków dla pozycji oddalonej o {current_distance:.2f} m od początku trasy (długość trasy: {self.total_route_length:.2f} m)")
-        self.print_info(f"Liczba przystanków do sprawdzenia: {len(stops_data)}")
-        
         # Sprawdź, czy przystanki mają już informacje o odległości od początku trasy
         has_distance_info = all("dist_from_start" in stop for stop in stops_data if isinstance(stop, dict))
         
@@ -379,11 +886,11 @@ class RouteTracker:
                 # Jeśli przystanki mają już informacje o odległości, użyj jej
                 if has_distance_info and "dist_from_start" in stop:
                     stop_distance = float(stop["dist_from_start"])
-                    self.print_info(f"Użyto istniejącej odległości z danych: {stop_distance:.2f} m")
+                    if self.verbose:
+                        self.print_info(f"Użyto istniejącej odległości z danych: {stop_distance:.2f} m")
                 else:
-                    # Oblicz odległość przystanku od początku trasy
-                    stop_point = Point(stop_position)
-                    stop_distance = self.route_line.project(stop_point)
+                    # Oblicz odległość przystanku od początku trasy (rzut na trasę, w metrach)
+                    stop_distance = self.distance_along_route((float(stop_position[0]), float(stop_position[1])))
                     
                     # Skoryguj błędy w odległości (czasami project() zwraca nieprawidłowe wartości)
                     if stop_distance < 0.1 or stop_distance > self.total_route_length * 1.1:
@@ -407,68 +914,76 @@ class RouteTracker:
             except Exception as e:
                 self.print_info(f"Pominięto przystanek z powodu błędu: {e}")
         
-        # Upewnij się, że mamy przystanki z odległościami
-        if not stops_with_distance:
-            self.print_info("Nie znaleziono przystanków z prawidłowymi odległościami")
-            return None, None
-            
         # Sortuj przystanki według odległości od początku trasy
         sorted_stops = sorted(stops_with_distance, key=lambda x: x["distance_from_start"])
         
         # Drukuj informacje o wszystkich przystankach
-        self.print_info("\nInformacje o wszystkich przystankach na trasie:")
-        for i, stop in enumerate(sorted_stops):
-            stop_lat, stop_lon = stop["position"][1], stop["position"][0]
-            stop_name = stop.get("name", "Brak nazwy")
-            self.print_info(f"{i+1}. Przystanek ID: {stop['id']} - {stop_name} (lat, lon): ({stop_lat}, {stop_lon}) - odległość: {stop['distance_from_start']:.2f} m")
-        
-        # 1. Znajdź poprzedni przystanek (ostatni przystanek przed lub równy aktualnej pozycji)
-        for i in range(len(sorted_stops) - 1, -1, -1):  # Przeszukujemy od końca do początku
-            stop = sorted_stops[i]
-            if stop["distance_from_start"] <= current_distance or abs(stop["distance_from_start"] - current_distance) < 1.0:
-                previous_stop = stop.copy()
-                previous_stop["distance_to_current"] = current_distance - stop["distance_from_start"]
+        if self.verbose:
+            self.print_info("\nInformacje o wszystkich przystankach na trasie:")
+            for i, stop in enumerate(sorted_stops):
+                stop_lat, stop_lon = stop["position"][1], stop["position"][0]
                 stop_name = stop.get("name", "Brak nazwy")
-                self.print_info(f"Znaleziono poprzedni przystanek: ID {stop['id']} - {stop_name}, odległość: {previous_stop['distance_to_current']:.2f} m")
-                break
+                self.print_info(f"{i+1}. Przystanek ID: {stop['id']} - {stop_name} (lat, lon): ({stop_lat}, {stop_lon}) - odległość: {stop['distance_from_start']:.2f} m")
         
-        # 2. Znajdź następny przystanek (pierwszy przystanek po aktualnej pozycji)
-        for stop in sorted_stops:
-            if stop["distance_from_start"] > current_distance:
-                next_stop = stop.copy()
-                next_stop["distance_from_current"] = stop["distance_from_start"] - current_distance
-                stop_name = stop.get("name", "Brak nazwy")
-                self.print_info(f"Znaleziono następny przystanek: ID {stop['id']} - {stop_name}, odległość: {next_stop['distance_from_current']:.2f} m")
-                break
+        return sorted_stops, [stop["distance_from_start"] for stop in sorted_stops]
+    
+    def find_nearest_stops(self, current_position, current_distance):
+        """Znajduje najbliższy poprzedni i następny przystanek."""
+        previous_stop = None
+        next_stop = None
         
-        # Wyświetl informacje o znalezionych przystankach
-        if previous_stop:
-            prev_name = previous_stop.get("name", "Brak nazwy")
-            self.print_info(f"Najbliższy poprzedni przystanek: ID {previous_stop['id']} - {prev_name}, {previous_stop['distance_to_current']:.2f} m za nami")
-        else:
-            self.print_info("Nie znaleziono poprzedniego przystanku - jesteśmy na początku trasy")
+        if not self.stops_data:
+            self.print_info("Brak danych o przystankach")
+            return previous_stop, next_stop
         
-        if next_stop:
-            next_name = next_stop.get("name", "Brak nazwy")
-            self.print_info(f"Najbliższy następny przystanek: ID {next_stop['id']} - {next_name}, {next_stop['distance_from_current']:.2f} m przed nami")
-        else:
-            self.print_info("Nie znaleziono następnego przystanku - jesteśmy na końcu trasy")
+        if self.verbose:
+            self.print_info(f"Szukanie przystanków dla pozycji oddalonej o {current_distance:.2f} m od początku trasy (długość trasy: {self.total_route_length:.2f} m)")
+        sorted_stops, stop_distances = self._stops, self._stops_dist
         
-        return previous_stop, next_stop
-
-    def find_segment_index(self, distance_from_start):
-        """Znajduje indeks segmentu, na którym znajduje się pozycja na podstawie odległości od początku trasy."""
-        if not isinstance(distance_from_start, (int, float)):
-            raise ValueError("Nieprawidłowy format odległości od początku trasy")
+        # Upewnij się, że mamy przystanki z odległościami
+        if not sorted_stops:
+            self.print_info("Nie znaleziono przystanków z prawidłowymi odległościami")
+            return None, None
         
-        target_distance = distance_from_start
-        cumulative_distance = 0
+        # 1. Znajdź poprzedni przystanek (ostatni przystanek przed aktualną pozycją lub mniej niż 1 m za nią)
+        i = bisect.bisect_left(stop_distances, current_distance + 1.0) - 1
+        if i >= 0:
+            stop = sorted_stops[i]
+            previous_stop = stop.copy()
+            previous_stop["distance_to_current"] = current_distance - stop["distance_from_start"]
         
-        self.print_info(f"Szukanie segmentu dla odległości {target_distance} m od początku trasy...")
+        # 2. Znajdź następny przystanek (pierwszy przystanek po aktualnej pozycji)
+        i = bisect.bisect_right(stop_distances, current_distance)
+        if i < len(sorted_stops):
+            stop = sorted_stops[i]
+            next_stop = stop.copy()
+            next_stop["distance_from_current"] = stop["distance_from_start"] - current_distance
+        
+        # Wyświetl informacje o znalezionych przystankach (formatowane tylko w trybie gadatliwym)
+        if self.verbose:
+            if previous_stop:
+                prev_name = previous_stop.get("name", "Brak nazwy")
+                self.print_info(f"Najbliższy poprzedni przystanek: ID {previous_stop['id']} - {prev_name}, {previous_stop['distance_to_current']:.2f} m za nami")
+            else:
+                self.print_info("Nie znaleziono poprzedniego przystanku - jesteśmy na początku trasy")
+            
+            if next_stop:
+                next_name = next_stop.get("name", "Brak nazwy")
+                self.print_info(f"Najbliższy następny przystanek: ID {next_stop['id']} - {next_name}, {next_stop['distance_from_current']:.2f} m przed nami")
+            else:
+                self.print_info("Nie znaleziono następnego przystanku - jesteśmy na końcu trasy")
         
+        return previous_stop, next_stop
+
+    def build_way_index(self):
+        """
+        Oblicza raz długości odcinków (ways) trasy i skumulowane odległości ich końców od początku trasy,
+        aby find_segment_index mógł wyszukiwać odcinek binarnie.
+        """
+        way_indices = []
+        way_lengths = []
         for i, way in enumerate(self.route_data):
-            segment_length = 0
-            nodes = way.get("nodes", [])
+            nodes = self._way_coords[i]
             
             # Sprawdź, czy mamy wystarczająco dużo węzłów
             if len(nodes) < 2:
@@ -476,83 +991,99 @@ class RouteTracker:
                 continue
             
             # Oblicz długość segmentu
-            for j in range(len(nodes) - 1):
-                try:
-                    node_distance = self.haversine_distance(nodes[j], nodes[j+1])
-                    segment_length += node_distance
-                except Exception as e:
-                    self.print_info(f"Błąd podczas obliczania odległości między węzłami w segmencie {i}: {e}")
-                    continue
+            try:
+                segment_length = self.polyline_length(nodes)
+            except Exception as e:
+                segment_length = 0
+                self.print_info(f"Błąd podczas obliczania odległości między węzłami w segmencie {i}: {e}")
+            
+            way_indices.append(i)
+            way_lengths.append(segment_length)
+        
+        self.set_way_index(way_indices, way_lengths)
+    
+    def set_way_index(self, way_indices, way_lengths):
+        """Zapisuje indeksy i długości odcinków (ways) oraz skumulowane odległości ich początków i końców."""
+        self._way_indices = way_indices
+        self._way_lengths = way_lengths
+        self._way_ends = np.cumsum(way_lengths) if way_lengths else np.zeros(0)
+        self._way_starts = np.concatenate(([0.0], self._way_ends[:-1]))
+    
+    def way_length(self, way_index):
+        """Zwraca zapisaną długość odcinka (way) o podanym indeksie; odcinki pominięte w tabeli mają długość 0."""
+        k = bisect.bisect_left(self._way_indices, way_index)
+        if k < len(self._way_indices) and self._way_indices[k] == way_index:
+            return self._way_lengths[k]
+        return 0
+    
+    def find_segment_index(self, distance_from_start):
+        """Znajduje indeks segmentu, na którym znajduje się pozycja na podstawie odległości od początku trasy."""
+        if not isinstance(distance_from_start, (int, float)):
+            raise ValueError("Nieprawidłowy format odległości od początku trasy")
+        
+        target_distance = distance_from_start
+        cumulative_distance = float(self._way_ends[-1]) if len(self._way_ends) else 0
+        
+        if self.verbose:
+            self.print_info(f"Szukanie segmentu dla odległości {target_distance} m od początku trasy...")
+        
+        # Pierwszy odcinek, którego koniec nie leży przed szukaną pozycją
+        k = int(np.searchsorted(self._way_ends, target_distance, side="left"))
+        if target_distance >= 0 and k < len(self._way_ends):
+            i = self._way_indices[k]
+            way = self._ways[i]
+            segment_length = self._way_lengths[k]
             
-            self.print_info(f"Segment {i} (ID: {way.get('id', 'nieznany')}) ma długość {segment_length} m")
-            self.print_info(f"Aktualna skumulowana odległość: {cumulative_distance} m")
-            self.print_info(f"Sprawdzam czy {cumulative_distance} <= {target_distance} <= {cumulative_distance + segment_length}")
+            # Oblicz dokładną pozycję w segmencie
+            segment_position = target_distance - float(self._way_starts[k])
+            segment_percentage = (segment_position / segment_length) * 100 if segment_length > 0 else 0
             
-            # Sprawdź, czy punkt jest w tym segmencie
-            if cumulative_distance <= target_distance <= cumulative_distance + segment_length:
-                # Oblicz dokładną pozycję w segmencie
-                segment_position = target_distance - cumulative_distance
-                segment_percentage = (segment_position / segment_length) * 100 if segment_length > 0 else 0
-                
-                self.print_info(f"Znaleziono segment! Indeks: {i}, ID: {way.get('id', 'nieznany')}")
+            if self.verbose:
+                self.print_info(f"Znaleziono segment! Indeks: {i}, ID: {way.id}")
                 self.print_info(f"Pozycja w segmencie: {segment_position} m / {segment_length} m ({segment_percentage:.2f}%)")
-                
-                return {
-                    "segment_index": i,
-                    "segment_id": way.get("id", ""),
-                    "distance_in_segment": segment_position,
-                    "segment_percentage": segment_percentage,
-                    "segment_length": segment_length,
-                    "start_node": way.get("start_node", ""),
-                    "end_node": way.get("end_node", "")
-                }
             
-            cumulative_distance += segment_length
+            return {
+                "segment_index": i,
+                "segment_id": way.id,
+                "distance_in_segment": segment_position,
+                "segment_percentage": segment_percentage,
+                "segment_length": segment_length,
+                "start_node": way.start_node,
+                "end_node": way.end_node
+            }
         
         # Jeśli punkt jest poza trasą, zwróć odpowiedni segment
         if self.route_data:
             if target_distance > cumulative_distance:
                 self.print_info(f"Pozycja poza trasą (za końcem) - odległość {target_distance} m > długość trasy {cumulative_distance} m")
                 # Zwróć ostatni segment
-                last_way = self.route_data[-1]
-                last_segment_length = 0
-                last_nodes = last_way.get("nodes", [])
-                for j in range(len(last_nodes) - 1):
-                    try:
-                        last_segment_length += self.haversine_distance(last_nodes[j], last_nodes[j+1])
-                    except Exception:
-                        continue
+                last_way = self._ways[-1]
+                last_segment_length = self.way_length(len(self.route_data) - 1)
                 
                 return {
                     "segment_index": len(self.route_data) - 1,
-                    "segment_id": last_way.get("id", ""),
+                    "segment_id": last_way.id,
                     "distance_in_segment": last_segment_length,
                     "segment_percentage": 100.0,
                     "segment_length": last_segment_length,
-                    "start_node": last_way.get("start_node", ""),
-                    "end_node": last_way.get("end_node", ""),
+                    "start_node": last_way.start_node,
+                    "end_node": last_way.end_node,
                     "warning": "Pozycja poza trasą - zwrócono ostatni segment"
                 }
             elif target_distance < 0:
                 self.print_info(f"Pozycja poza trasą (przed początkiem) - odległość {target_distance} m < 0")
                 # Zwróć pierwszy segment
-                first_way = self.route_data[0]
-                first_segment_length = 0
-                first_nodes = first_way.get("nodes", [])
-                for j in range(len(first_nodes) - 1):
-                    try:
-                        first_segment_length += self.haversine_distance(first_nodes[j], first_nodes[j+1])
-                    except Exception:
-                        continue
+                first_way = self._ways[0]
+                first_segment_length = self.way_length(0)
                 
                 return {
                     "segment_index": 0,
-                    "segment_id": first_way.get("id", ""),
+                    "segment_id": first_way.id,
                     "distance_in_segment": 0,
                     "segment_percentage": 0.0,
                     "segment_length": first_segment_length,
-                    "start_node": first_way.get("start_node", ""),
-                    "end_node": first_way.get("end_node", ""),
+                    "start_node": first_way.start_node,
+                    "end_node": first_way.end_node,
                     "warning": "Pozycja przed trasą - zwrócono pierwszy segment"
                 }
         
@@ -564,30 +1095,40 @@ class RouteTracker:
         try:
             summary_file = route_file.replace("_ways_ordered.json", "_summary.txt")
             if os.path.exists(summary_file):
-                with open(summary_file, 'r', encoding='utf-8') as f:
-                    summary_data = f.readlines()
-                
-                for line in summary_data:
-                    if "Całkowita długość trasy:" in line:
-                        parts = line.split(":")
-                        if len(parts) > 1:
-                            dist_part = parts[1].strip()
-                            dist_value = dist_part.split(" ")[0]  # Bierz tylko liczbę
-                            try:
-                                return float(dist_value)
-                            except ValueError:
-                                pass
+                return _summary_length(summary_file, os.stat(summary_file).st_mtime_ns)
         except Exception as e:
             self.print_info(f"Błąd podczas pobierania długości trasy z pliku summary: {e}")
         
         return None
     
-    def locate(self, lat, lon):
-        """Główna funkcja lokalizująca pojazd na trasie."""
+    def locate(self, lat, lon, hint=None):
+        """
+        Główna funkcja lokalizująca pojazd na trasie.
+        Opcjonalny hint to edge_index z poprzedniego wyniku - przyspiesza szukanie najbliższego punktu.
+        """
         # Sprawdź, czy klasa jest zainicjalizowana
         if not hasattr(self, 'ready') or not self.ready:
             raise ValueError("RouteTracker nie jest gotowy. Sprawdź, czy inicjalizacja przebiegła pomyślnie.")
         
+        # Wynik dla tych samych współrzędnych (zaokrąglonych do ~11 cm) mógł zostać zapisany w poprzednim uruchomieniu.
+        # Wynik z innej części trasy niż hint (ten sam punkt na drugim przejeździe) jest liczony ponownie.
+        if self._disk_cache is not None:
+            key = f"{round(lat, 6)},{round(lon, 6)}"
+            result = self._disk_cache_pending.get(key)
+            if result is None:
+                result = self._disk_cache.get(key)
+            if result is None or not self.result_matches_hint(result, hint):
+                result = self.compute_location(lat, lon, hint)
+                # Zapis na dysk odbywa się paczkami, a nie przy każdej nowej pozycji
+                self._disk_cache_pending[key] = result
+                if len(self._disk_cache_pending) >= self.LOCATE_DISK_CACHE_FLUSH:
+                    self.flush_locate_cache()
+            return result
+        
+        return self.compute_location(lat, lon, hint)
+    
+    def compute_location(self, lat, lon, hint=None):
+        """Oblicza pozycję pojazdu na trasie (bez korzystania z pamięci wyników)."""
         # Zamień kolejność na [longitude, latitude] dla standardu GeoJSON
         location = (lon, lat)
         
@@ -595,10 +1136,11 @@ class RouteTracker:
         if not isinstance(location, (list, tuple)) or len(location) < 2:
             raise ValueError("Nieprawidłowy format lokalizacji")
         
-        self.print_info(f"Lokalizowanie punktu {location} na trasie...")
+        if self.verbose:
+            self.print_info(f"Lokalizowanie punktu {location} na trasie...")
         
         # Znajdź pozycję na trasie
-        position_info = self.find_location_on_route(location)
+        position_info = self.find_location_on_route(location, hint)
         
         # Znajdź segment, na którym znajduje się pozycja
         segment_info = None
@@ -619,6 +1161,7 @@ class RouteTracker:
             "nearest_point_on_route": position_info["nearest_point"],
             "distance_from_start": position_info["distance_from_start"],
             "distance_to_route": position_info["distance_to_route"],
+            "edge_index": position_info["edge_index"],
             "previous_stop": prev_stop,
             "next_stop": next_stop,
             "segment_info": segment_info,
@@ -629,7 +1172,7 @@ class RouteTracker:
         }
         
         return result
-
+    
     def generate_navigation_directions(self):
         """Generuje wskazówki nawigacyjne na podstawie trasy."""
         if not self.route_data:
@@ -679,16 +1222,12 @@ class RouteTracker:
             first_way = self.route_data[0]
             directions.append(f"Rozpocznij trasę w punkcie startowym (węzeł {first_way.get('start_node', 'nieznany')}).")
         
-        # Znajdź pierwszy kierunek
+        # Znajdź pierwszy kierunek (jest też początkowym kierunkiem jazdy)
+        last_significant_bearing = None
         if len(route_points) >= 3:
             initial_bearing = self.calculate_bearing(route_points[0], route_points[2])
             directions.append(f"Kieruj się na {self.get_cardinal_direction(initial_bearing)}.")
-        
-        # Wykryj istotne zakręty na trasie
-        last_significant_bearing = None
-        if len(route_points) >= 3:
-            # Ustaw początkowy kierunek jazdy
-            last_significant_bearing = self.calculate_bearing(route_points[0], route_points[2])
+            last_significant_bearing = initial_bearing
         
         # Parametry do wykrywania zakrętów
         step_size = 10  # Krok w punktach trasy
@@ -696,25 +1235,59 @@ class RouteTracker:
         lookahead = 20   # Ile punktów w przód patrzymy
         min_turn_threshold = 40  # Minimalny kąt zmiany kierunku uznawany za zakręt (w stopniach)
         
+        # Punkty trasy jako jedna tablica (n, 2), przeliczona raz dla odległości i azymutów
+        try:
+            pts = np.asarray(route_points, dtype=np.float64)[:, :2]
+        except (ValueError, TypeError, IndexError):
+            # Niejednorodne dane - odległości i azymuty liczone punkt po punkcie
+            pts = None
+        
+        # Odległości od początku trasy do każdego punktu (liczone raz, a nie od nowa dla każdego zakrętu)
+        route_distances = self.cumulative_distances(route_points if pts is None else pts)
+        
+        # Azymuty przed i po każdym punkcie liczone wektorowo jednym przebiegiem (pre[i] i post[i] dla punktu i)
+        pre_bearings = post_bearings = None
+        if pts is not None and len(pts) > lookback + lookahead:
+            lon, lat = pts[:, 0], pts[:, 1]
+            pre_bearings = _bearings(lon[:-lookback], lat[:-lookback], lon[lookback:], lat[lookback:])
+            post_bearings = _bearings(lon[:-lookahead], lat[:-lookahead], lon[lookahead:], lat[lookahead:])
+        
+        # Punkty, w których kierunek zmienia się co najmniej o próg, wyznaczone wektorowo i pogrupowane według
+        # reszty z dzielenia indeksu przez step_size - pętla poniżej przeskakuje od razu do kolejnego zakrętu
+        turn_candidates = None
+        if pre_bearings is not None:
+            end = len(route_points) - lookahead
+            changes = (post_bearings[lookback:end] - pre_bearings[:end - lookback] + 180) % 360 - 180
+            turn_candidates = collections.defaultdict(list)
+            for j in (np.flatnonzero(np.abs(changes) >= min_turn_threshold) + lookback).tolist():
+                turn_candidates[j % step_size].append(j)
+        
         turn_points = []
         i = lookback
         while i < len(route_points) - lookahead:
-            # Sprawdź kierunek jazdy przed potencjalnym zakrętem
-            pre_turn_bearing = self.calculate_bearing(route_points[i-lookback], route_points[i])
-            
-            # Sprawdź kierunek jazdy po potencjalnym zakręcie
-            post_turn_bearing = self.calculate_bearing(route_points[i], route_points[i+lookahead])
+            if turn_candidates is not None:
+                # Pierwszy zakręt na siatce kroków, po której przesuwa się i (i, i + step_size, ...)
+                candidates = turn_candidates[i % step_size]
+                k = bisect.bisect_left(candidates, i)
+                if k == len(candidates):
+                    break
+                i = candidates[k]
+                pre_turn_bearing = float(pre_bearings[i - lookback])
+                post_turn_bearing = float(post_bearings[i])
+            else:
+                # Sprawdź kierunek jazdy przed potencjalnym zakrętem
+                pre_turn_bearing = self.calculate_bearing(route_points[i-lookback], route_points[i])
+                
+                # Sprawdź kierunek jazdy po potencjalnym zakręcie
+                post_turn_bearing = self.calculate_bearing(route_points[i], route_points[i+lookahead])
             
             # Oblicz zmianę kierunku (skręt)
             bearing_change = (post_turn_bearing - pre_turn_bearing + 180) % 360 - 180
             
             # Jeśli jest to istotna zmiana kierunku
             if abs(bearing_change) >= min_turn_threshold:
-                # Oblicz dystans od początku trasy do punktu zakrętu
-                current_distance = 0
-                for j in range(i):
-                    if j < len(route_points) - 1:
-                        current_distance += self.haversine_distance(route_points[j], route_points[j+1])
+                # Dystans od początku trasy do punktu zakrętu
+                current_distance = float(route_distances[i])
                 
                 # Określ kierunek skrętu
                 turn_direction = "w prawo" if bearing_change > 0 else "w lewo"
@@ -818,33 +1391,15 @@ class RouteTracker:
         Oblicza azymut (kąt) między dwoma punktami.
         Zwraca wartość w stopniach (0-359), gdzie 0 to północ, 90 to wschód, itd.
         """
-        import math
-        
         lon1, lat1 = point1
         lon2, lat2 = point2
-        
-        # Zamiana stopni na radiany
-        lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-        
-        # Wzór na azymut
-        y = math.sin(lon2 - lon1) * math.cos(lat2)
-        x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(lon2 - lon1)
-        bearing = math.atan2(y, x)
-        
-        # Zamiana radianów na stopnie i normalizacja do zakresu 0-359
-        bearing = (math.degrees(bearing) + 360) % 360
-        
-        return bearing
+        return _bearing_deg(lon1, lat1, lon2, lat2)
 
     def get_cardinal_direction(self, bearing):
         """
         Zwraca kierunek świata (N, NE, E, SE, S, SW, W, NW) dla danego azymutu.
         """
-        directions = ["północ", "północny wschód", "wschód", "południowy wschód", 
-                    "południe", "południowy zachód", "zachód", "północny zachód"]
-        
-        index = round(bearing / 45) % 8
-        return directions[index]
+        return _CARDINAL_DIRECTIONS[round(bearing / 45) % 8]
 
     def round_to_nearest_10(self, value):
         """
@@ -864,12 +1419,9 @@ class RouteTracker:
         Returns:
             Zaktualizowane wskazówki i najbliższy punkt charakterystyczny
         """
-        # Jeśli nie mamy wygenerowanych wskazówek, zrób to najpierw
-        if not hasattr(self, 'navigation_directions') or not hasattr(self, 'navigation_points'):
-            self.navigation_directions, self.navigation_points = self.generate_navigation_directions()
-        else:
-            # Użyj już wygenerowanych wskazówek
-            significant_points = self.navigation_points
+        # Jeśli nie mamy wygenerowanych wskazówek, zrób to najpierw (jednorazowo)
+        if self._navigation_distances is None:
+            self.initialize_navigation()
         
         # Pobierz wygenerowane punkty
         significant_points = self.navigation_points
@@ -878,17 +1430,18 @@ class RouteTracker:
         next_point = None
         prev_point = None
         
-        # Znajdź najbliższy następny punkt
-        for i, point in enumerate(significant_points):
-            if point["distance"] > current_distance:
-                next_point = point.copy()
-                # Zaktualizuj odległość do tego punktu
-                next_point["distance_to_current"] = point["distance"] - current_distance
-                
-                # Jeśli to nie pierwszy punkt, zapisz również poprzedni
-                if i > 0:
-                    prev_point = significant_points[i-1].copy()
-                break
+        # Najbliższy następny punkt to pierwszy punkt dalej od początku trasy niż aktualna pozycja
+        # (punkty są posortowane według odległości - wyszukiwanie binarne zamiast przeglądania listy)
+        i = bisect.bisect_right(self._navigation_distances, current_distance)
+        if i < len(significant_points):
+            point = significant_points[i]
+            next_point = point.copy()
+            # Zaktualizuj odległość do tego punktu
+            next_point["distance_to_current"] = point["distance"] - current_distance
+            
+            # Jeśli to nie pierwszy punkt, zapamiętaj również poprzedni (tylko do odczytu - bez kopiowania)
+            if i > 0:
+                prev_point = significant_points[i-1]
         
         # Jeśli nie znaleziono następnego punktu, jesteśmy blisko końca
         if next_point is None and significant_points:
@@ -923,21 +1476,85 @@ class RouteTracker:
         
         return current_instruction, next_point, significant_points
 
+    def upcoming_navigation_points(self, current_distance, count):
+        """Zwraca co najwyżej count najbliższych punktów charakterystycznych leżących dalej niż current_distance."""
+        if self._navigation_distances is None:
+            self.initialize_navigation()
+        i = bisect.bisect_right(self._navigation_distances, current_distance)
+        return self.navigation_points[i:i + count]
+    
     def initialize_navigation(self):
-        """Inicjalizuje nawigację, generując wskazówki i punkty charakterystyczne."""
+        """Inicjalizuje nawigację, generując wskazówki i punkty charakterystyczne (tylko przy pierwszym wywołaniu)."""
+        if self._navigation_distances is not None:
+            return self.navigation_directions, self.navigation_points
+        
         # Generuj wskazówki i zapisz je jako atrybuty klasy
         self.navigation_directions, self.navigation_points = self.generate_navigation_directions()
+        # Odległości punktów charakterystycznych (posortowane) do wyszukiwania binarnego w update_navigation_distances
+        self._navigation_distances = [point["distance"] for point in self.navigation_points]
         self.print_info(f"Wygenerowano {len(self.navigation_directions)} wskazówek i {len(self.navigation_points)} punktów charakterystycznych")
         return self.navigation_directions, self.navigation_points
 
+# Wszystkie możliwe paski postępu między przystankami (indeks = liczba wypełnionych pól)
+_PROGRESS_BAR_WIDTH = 50
+_PROGRESS_BARS = tuple('█' * i + '░' * (_PROGRESS_BAR_WIDTH - i) for i in range(_PROGRESS_BAR_WIDTH + 1))
+
+class VehiclePosition(NamedTuple):
+    """Pozycja pojazdu odczytana z websocketa (niezmienna krotka z dostępem do pól jak do atrybutów)."""
+    lat: float
+    lon: float
+    ts: Optional[float] = None
+    heading: Optional[float] = None
+    speed: Optional[float] = None
+    line: Optional[str] = None
+    brigade: Optional[str] = None
+
+# Ostatnio sformatowana sekunda i jej tekst (strftime jest wolne, a sekunda zmienia się rzadziej niż ekran)
+_time_format_cache = (None, "")
+
+def _format_time(timestamp):
+    """Formatuje znacznik czasu jako "RRRR-MM-DD GG:MM:SS" w czasie lokalnym, formatując każdą sekundę tylko raz."""
+    global _time_format_cache
+    second = math.floor(timestamp)
+    if _time_format_cache[0] == second:
+        return _time_format_cache[1]
+    text = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+    _time_format_cache = (second, text)
+    return text
+
+def _moved(a, b, deadband_m):
+    """Sprawdza, czy pozycje a i b są od siebie dalej niż deadband_m metrów (przybliżenie równoodległościowe)."""
+    return _equirect_m(b.lon, b.lat, a.lon, a.lat, math.cos(b.lat * _D2R)) > deadband_m
+
 class WebSocketTracker:
     """Klasa do śledzenia pojazdów za pomocą WebSocket."""
     
+    __slots__ = (
+        "tracker", "websocket_url", "vehicle_id", "update_interval", "verbose", "running",
+        "last_position", "last_result", "last_update_time", "map_visualizer",
+        "_locate_cache", "_locate_cache_tracker", "_last_render_key", "_tty",
+        "_vehicle_number"
+    )
+    
+    # Maksymalna liczba zapamiętanych wyników lokalizacji (dla zaokrąglonych współrzędnych)
+    LOCATE_CACHE_SIZE = 256
+    # Maksymalna liczba ramek pobieranych w jednej paczce
+    DRAIN_MAX_FRAMES = 100
+    # Minimalne przesunięcie (w metrach) uznawane za ruch pojazdu - mniejsze zmiany to szum GPS
+    POSITION_DEADBAND_M = 1.0
+    
     def __init__(self, tracker, websocket_url, vehicle_id, update_interval=1.0, verbose=False):
         """Inicjalizacja z trackerem, URL websocketa i numerem pojazdu."""
         self.tracker = tracker
         self.websocket_url = websocket_url
         self.vehicle_id = str(vehicle_id)  # Upewnij się, że numer pojazdu jest stringiem
+        # Liczba, której str() daje numer pojazdu (lub None) - liczbowe veh_number porównujemy
+        # bez tworzenia str() dla każdego pojazdu w każdej wiadomości
+        try:
+            number = int(self.vehicle_id)
+        except ValueError:
+            number = None
+        self._vehicle_number = number if number is not None and str(number) == self.vehicle_id else None
         self.update_interval = update_interval
         self.verbose = verbose
         self.running = False
@@ -945,6 +1562,11 @@ class WebSocketTracker:
         self.last_result = None
         self.last_update_time = None
         self.map_visualizer = None
+        self._locate_cache = collections.OrderedDict()
+        self._locate_cache_tracker = tracker
+        self._last_render_key = None
+        # Bez terminala (np. usługa z wyjściem do logu) wypisujemy zwięzły wiersz JSON zamiast ekranu dla człowieka
+        self._tty = sys.stdout.isatty()
     
     def print_info(self, message):
         """Wyświetla komunikat, tylko jeśli tryb gadatliwy jest włączony."""
@@ -954,8 +1576,7 @@ class WebSocketTracker:
     def format_timestamp(self, timestamp):
         """Formatuje timestamp do czytelnej postaci."""
         try:
-            dt = datetime.fromtimestamp(timestamp)
-            return dt.strftime("%Y-%m-%d %H:%M:%S")
+            return _format_time(timestamp)
         except:
             return str(timestamp)
     
@@ -987,26 +1608,23 @@ class WebSocketTracker:
         
         vehicles = data
         
-        # Debugowanie - wypisz liczbę pojazdów
-        self.print_info(f"Znaleziono {len(vehicles)} pojazdów w danych")
+        # Znajdź pojazd o określonym numerze
+        vehicle = self._find_vehicle_by_number(vehicles)
+        if vehicle is not None:
+            if self.verbose:
+                self.print_info(f"Znaleziono pojazd o numerze {self.vehicle_id}")
+            return vehicle
         
-        # Jeśli w trybie gadatliwym, wypisz kilka pierwszych pojazdów
+        # Nie znaleziono pojazdu - w trybie gadatliwym pokaż dane diagnostyczne
         if self.verbose and len(vehicles) > 0:
+            self.print_info(f"Znaleziono {len(vehicles)} pojazdów w danych")
             sample_size = min(3, len(vehicles))
             self.print_info(f"Przykładowe pojazdy (pierwsze {sample_size}):")
             for i in range(sample_size):
-                vehicle = vehicles[i]
-                veh_number = vehicle.get("veh_number", "N/A")
+                veh_number = vehicles[i].get("veh_number", "N/A")
                 self.print_info(f"  - Pojazd #{i+1}: veh_number={veh_number}")
-        
-        # Znajdź pojazd o określonym numerze
-        for vehicle in vehicles:
-            if str(vehicle.get("veh_number", "")) == self.vehicle_id:
-                self.print_info(f"Znaleziono pojazd o numerze {self.vehicle_id}")
-                return vehicle
-        
-        # Nie znaleziono pojazdu - pokaż listę wszystkich dostępnych pól w pierwszym pojeździe
-        if self.verbose and len(vehicles) > 0:
+            
+            # Pokaż listę wszystkich dostępnych pól w pierwszym pojeździe
             self.print_info(f"Dostępne pola w pierwszym pojeździe:")
             for key in vehicles[0].keys():
                 self.print_info(f"  - {key}: {vehicles[0].get(key)}")
@@ -1017,6 +1635,27 @@ class WebSocketTracker:
         
         return None
     
+    def _find_vehicle_by_number(self, vehicles):
+        """
+        Zwraca pierwszy pojazd o śledzonym numerze (lub None), przerywając przeszukiwanie po trafieniu.
+        Pojazd pasuje, gdy str(veh_number) jest równe numerowi pojazdu.
+        """
+        vehicle_id = self.vehicle_id
+        number = self._vehicle_number
+        for v in vehicles:
+            veh_number = v.get("veh_number", "")
+            veh_type = type(veh_number)
+            if veh_type is str:
+                if veh_number == vehicle_id:
+                    return v
+            elif veh_type is int:
+                # type() zamiast isinstance - True/False nie mogą pasować do numeru 1/0
+                if veh_number == number:
+                    return v
+            elif str(veh_number) == vehicle_id:
+                return v
+        return None
+    
     def extract_location(self, vehicle_data):
         """Wyciąga pozycję z danych pojazdu."""
         if not vehicle_data or not isinstance(vehicle_data, dict):
@@ -1033,15 +1672,10 @@ class WebSocketTracker:
                 return None
             
             # Zwróć info o pozycji i inne przydatne dane
-            return {
-                "latitude": latitude,
-                "longitude": longitude,
-                "timestamp": vehicle_data.get("timestamp", None),
-                "heading": vehicle_data.get("heading", None),
-                "speed": vehicle_data.get("speed", None),
-                "line": vehicle_data.get("line", None),
-                "brigade": vehicle_data.get("brigade", None)
-            }
+            get = vehicle_data.get
+            return VehiclePosition(
+                latitude, longitude, get("timestamp"), get("heading"), get("speed"), get("line"), get("brigade")
+            )
         except Exception as e:
             self.print_info(f"Błąd podczas wyciągania pozycji: {e}")
             return None
@@ -1051,52 +1685,61 @@ class WebSocketTracker:
         if not position or not result:
             return
         
+        if not self._tty:
+            sys.stdout.write(_dumps_bytes({
+                "vid": self.vehicle_id,
+                "lat": position.lat,
+                "lon": position.lon,
+                "d": result['distance_from_start'],
+                "pct": result['progress_percentage']
+            }).decode("utf-8") + "\n")
+            sys.stdout.flush()
+            return
+        
         # Pobierz aktualne wskazówki nawigacyjne
         current_instruction, next_point, all_points = self.tracker.update_navigation_distances(result['distance_from_start'])
         
+        # Cały ekran jest składany w buforze i wypisywany (razem z czyszczeniem konsoli) jednym zapisem
+        lines = []
+        out = lines.append
+        
         # Nagłówek z podstawowymi informacjami
-        clear_console()
-        print("\n=== ŚLEDZENIE POJAZDU ===")
-        print(f"Numer pojazdu: {self.vehicle_id}")
-        if "line" in position:
-            print(f"Linia: {position.get('line', 'N/A')}")
-        if "brigade" in position:
-            print(f"Brygada: {position.get('brigade', 'N/A')}")
-        if "timestamp" in position:
-            print(f"Czas pomiaru: {self.format_timestamp(position.get('timestamp'))}")
-        if "speed" in position:
-            speed = position.get('speed', 0)
-            if isinstance(speed, (int, float)):
-                print(f"Prędkość: {speed:.1f} km/h")
+        out("\n=== ŚLEDZENIE POJAZDU ===")
+        out(f"Numer pojazdu: {self.vehicle_id}")
+        out(f"Linia: {position.line}")
+        out(f"Brygada: {position.brigade}")
+        out(f"Czas pomiaru: {self.format_timestamp(position.ts)}")
+        if isinstance(position.speed, (int, float)):
+            out(f"Prędkość: {position.speed:.1f} km/h")
         
         # Wskazówka nawigacyjna
-        print("\n=== WSKAZÓWKA NAWIGACYJNA ===")
-        print(current_instruction)
+        out("\n=== WSKAZÓWKA NAWIGACYJNA ===")
+        out(current_instruction)
         
         # Informacje o pozycji na trasie
-        print("\n--- POZYCJA NA TRASIE ---")
-        print(f"Współrzędne GPS: ({position['latitude']:.6f}, {position['longitude']:.6f})")
-        print(f"Odległość od początku trasy: {result['distance_from_start']:.2f} m")
-        print(f"Odległość od trasy: {result['distance_to_route']:.2f} m")
-        print(f"Postęp trasy: {result['progress_percentage']:.2f}%")
+        out("\n--- POZYCJA NA TRASIE ---")
+        out(f"Współrzędne GPS: ({position.lat:.6f}, {position.lon:.6f})")
+        out(f"Odległość od początku trasy: {result['distance_from_start']:.2f} m")
+        out(f"Odległość od trasy: {result['distance_to_route']:.2f} m")
+        out(f"Postęp trasy: {result['progress_percentage']:.2f}%")
         
         # Informacje o przystankach
-        print("\n--- PRZYSTANKI ---")
+        out("\n--- PRZYSTANKI ---")
         if result['previous_stop']:
             prev = result['previous_stop']
             prev_name = prev.get('name', 'Brak nazwy')
-            print(f"Poprzedni przystanek: {prev_name}")
-            print(f"  Odległość za pojazdem: {prev['distance_to_current']:.2f} m")
+            out(f"Poprzedni przystanek: {prev_name}")
+            out(f"  Odległość za pojazdem: {prev['distance_to_current']:.2f} m")
         else:
-            print("Brak poprzedniego przystanku (początek trasy)")
+            out("Brak poprzedniego przystanku (początek trasy)")
         
         if result['next_stop']:
             next_s = result['next_stop']
             next_name = next_s.get('name', 'Brak nazwy')
-            print(f"Następny przystanek: {next_name}")
-            print(f"  Odległość przed pojazdem: {next_s['distance_from_current']:.2f} m")
+            out(f"Następny przystanek: {next_name}")
+            out(f"  Odległość przed pojazdem: {next_s['distance_from_current']:.2f} m")
         else:
-            print("Brak następnego przystanku (koniec trasy)")
+            out("Brak następnego przystanku (koniec trasy)")
         
         # Postęp między przystankami
         if result['previous_stop'] and result['next_stop']:
@@ -1108,59 +1751,86 @@ class WebSocketTracker:
             current_distance_from_prev = result['distance_from_start'] - prev_stop['distance_from_start']
             progress_between_stops = (current_distance_from_prev / total_distance_between_stops * 100) if total_distance_between_stops > 0 else 0
             
-            print(f"\nOdcinek: {prev_name} → {next_name}")
-            print(f"Postęp na odcinku: {progress_between_stops:.2f}%")
+            out(f"\nOdcinek: {prev_name} → {next_name}")
+            out(f"Postęp na odcinku: {progress_between_stops:.2f}%")
             
             # Wizualizacja postępu na odcinku
-            bar_width = 50
-            filled_width = int(bar_width * progress_between_stops / 100)
-            progress_bar = '█' * filled_width + '░' * (bar_width - filled_width)
-            print(f"{prev_name} {progress_bar} {next_name}")
+            filled_width = int(_PROGRESS_BAR_WIDTH * progress_between_stops / 100)
+            progress_bar = _PROGRESS_BARS[max(0, min(_PROGRESS_BAR_WIDTH, filled_width))]
+            out(f"{prev_name} {progress_bar} {next_name}")
         
         # Nadchodzące punkty charakterystyczne
         if all_points:
-            print("\n--- NADCHODZĄCE PUNKTY CHARAKTERYSTYCZNE ---")
-            upcoming_count = 0
-            for point in all_points:
-                if point["distance"] > result['distance_from_start']:
-                    dist_to_point = point["distance"] - result['distance_from_start']
-                    if dist_to_point < 1000:
-                        rounded_dist = self.tracker.round_to_nearest_10(dist_to_point)
-                        dist_formatted = f"ok. {rounded_dist} m"
-                    else:
-                        dist_formatted = f"{dist_to_point/1000:.1f} km"
-                    
-                    point_type = "Zakręt" if point.get("type") == "turn" else "Przystanek"
-                    print(f"  • {point_type} za {dist_formatted}: {point['instruction']}")
-                    
-                    upcoming_count += 1
-                    if upcoming_count >= 3:  # Pokaż tylko 3 najbliższe punkty
-                        break
+            out("\n--- NADCHODZĄCE PUNKTY CHARAKTERYSTYCZNE ---")
+            # Pokaż tylko 3 najbliższe punkty
+            for point in self.tracker.upcoming_navigation_points(result['distance_from_start'], 3):
+                dist_to_point = point["distance"] - result['distance_from_start']
+                if dist_to_point < 1000:
+                    rounded_dist = self.tracker.round_to_nearest_10(dist_to_point)
+                    dist_formatted = f"ok. {rounded_dist} m"
+                else:
+                    dist_formatted = f"{dist_to_point/1000:.1f} km"
+                
+                point_type = "Zakręt" if point.get("type") == "turn" else "Przystanek"
+                out(f"  • {point_type} za {dist_formatted}: {point['instruction']}")
         
         # Informacja o aktualnym czasie (dla odniesienia)
-        print(f"\nAktualny czas: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        print("Naciśnij Ctrl+C, aby zakończyć śledzenie...")
+        out(f"\nAktualny czas: {_format_time(time.time())}")
+        out("Naciśnij Ctrl+C, aby zakończyć śledzenie...")
+        write_lines(lines, clear=True)
+    
+    def locate_cached(self, lat, lon, hint=None):
+        """
+        Lokalizuje pojazd na trasie, zapamiętując wyniki dla współrzędnych zaokrąglonych do 6 miejsc (~11 cm).
+        Pojazd stojący na przystanku nie powoduje ponownych obliczeń geometrycznych.
+        Zapamiętany wynik z innej części trasy niż hint (ten sam punkt na drugim przejeździe) jest liczony ponownie.
+        """
+        # Nowy tracker (np. ponownie wczytana trasa) unieważnia zapamiętane wyniki
+        if self._locate_cache_tracker is not self.tracker:
+            self._locate_cache.clear()
+            self._locate_cache_tracker = self.tracker
+        
+        key = (round(lat, 6), round(lon, 6))
+        result = self._locate_cache.get(key)
+        if result is not None and self.tracker.result_matches_hint(result, hint):
+            self._locate_cache.move_to_end(key)
+            return result
+        
+        result = self.tracker.locate(lat, lon, hint)
+        self._locate_cache[key] = result
+        if len(self._locate_cache) > self.LOCATE_CACHE_SIZE:
+            self._locate_cache.popitem(last=False)
+        return result
     
     def handle_position_update(self, position):
         """Obsługuje aktualizację pozycji pojazdu."""
         if not position:
             return
         
-        now = time.time()
+        now = time.monotonic()  # Zegar monotoniczny - nie cofa się przy korekcie czasu systemowego
         
-        # Sprawdź, czy pozycja się zmieniła
-        is_new_position = (self.last_position is None or 
-                        position['latitude'] != self.last_position['latitude'] or 
-                        position['longitude'] != self.last_position['longitude'])
+        # Sprawdź, czy pozycja się zmieniła (drgania GPS poniżej POSITION_DEADBAND_M nie są ruchem;
+        # taka pozycja zostanie i tak przetworzona po update_interval)
+        is_new_position = self.last_position is None or _moved(position, self.last_position, self.POSITION_DEADBAND_M)
         
         # Aktualizuj tylko jeśli pozycja się zmieniła lub minęło wystarczająco dużo czasu
         if is_new_position or self.last_update_time is None or (now - self.last_update_time) >= self.update_interval:
             try:
                 # Lokalizuj na trasie
-                result = self.tracker.locate(position['latitude'], position['longitude'])
+                # Zacznij szukanie od odcinka, na którym pojazd był ostatnio
+                hint = self.last_result.get("edge_index") if self.last_result else None
+                result = self.locate_cached(position.lat, position.lon, hint)
                 
-                # Wyświetl informacje
-                self.pretty_print_position(position, result)
+                # Wyświetl informacje tylko, jeśli zmieniła się pozycja na trasie lub sąsiednie przystanki
+                prev_stop, next_stop = result['previous_stop'], result['next_stop']
+                render_key = (
+                    round(result['distance_from_start'], 1),
+                    prev_stop['id'] if prev_stop else None,
+                    next_stop['id'] if next_stop else None
+                )
+                if render_key != self._last_render_key:
+                    self._last_render_key = render_key
+                    self.pretty_print_position(position, result)
                 
                 # Aktualizuj wizualizację na mapie
                 # if self.map_visualizer:
@@ -1173,6 +1843,31 @@ class WebSocketTracker:
             except Exception as e:
                 print(f"Błąd podczas lokalizacji pojazdu: {e}")
 
+    async def receive_latest(self, websocket):
+        """
+        Czeka na ramkę z websocketa, a następnie pobiera ramki zalegające w buforze
+        i zwraca tylko najnowszą - starsze dane i tak zostałyby od razu nadpisane.
+        Ramki z innymi tematami nie zastępują wcześniejszej ramki z pozycjami pojazdów.
+        """
+        recv = websocket.recv
+        message = await recv()
+        for _ in range(self.DRAIN_MAX_FRAMES):
+            # Ramka z bufora jest odbierana w jednym kroku pętli zdarzeń - bez czekania na nowe dane
+            pending = asyncio.ensure_future(recv())
+            await asyncio.sleep(0)
+            if not pending.done():
+                # Bufor pusty - przerwanie recv w websockets nie gubi wiadomości
+                pending.cancel()
+                await asyncio.wait([pending])
+                break
+            if pending.exception() is not None:
+                # Połączenie zamknięte - zgłosi to kolejne wywołanie recv
+                break
+            frame = pending.result()
+            if _is_vehicles_frame(frame) or not _is_vehicles_frame(message):
+                message = frame
+        return message
+    
     async def start_tracking(self):
         """Rozpoczyna śledzenie pojazdu poprzez WebSocket."""
         self.running = True
@@ -1186,36 +1881,52 @@ class WebSocketTracker:
         
         # Inicjalizacja wizualizatora mapy
         # Linie zakomentowane - zgodnie z życzeniem użytkownika
-        # self.map_visualizer = RouteMapVisualizer(self.tracker)
+        # self.map_visualizer = RouteMapVisualizer(self.tracker)  # live_port=8765 - aktualizacje przez websocket
+        # await self.map_visualizer.start_live_server()
         # self.map_visualizer.start_auto_refresh(interval=5)
         
         try:
             async with websockets.connect(self.websocket_url) as websocket:
                 print("Połączono z websocketem. Oczekiwanie na dane...")
                 
+                # Metody używane w każdej iteracji pętli pobrane raz (zmienne lokalne zamiast wyszukiwania atrybutów)
+                receive = self.receive_latest
+                find = self.find_vehicle_in_data
+                extract = self.extract_location
+                handle = self.handle_position_update
+                info = self.print_info
+                loads = _json.loads
+                decode_error = _json.JSONDecodeError
+                
                 while self.running:
                     try:
-                        # Pobierz dane z websocketa
-                        message = await websocket.recv()
+                        # Pobierz dane z websocketa (tylko najnowszą z zaległych ramek)
+                        message = await receive(websocket)
+                        
+                        # Odrzuć ramki z innymi tematami bez parsowania JSON
+                        # (dokładne sprawdzenie tematu nadal odbywa się w find_vehicle_in_data)
+                        if not _is_vehicles_frame(message):
+                            info("Pominięto wiadomość o temacie innym niż 'vehicles_info'")
+                            continue
                         
-                        # Parsuj JSON
+                        # Parsuj JSON (orjson przyjmuje zarówno ramki tekstowe, jak i binarne)
                         try:
-                            data = json.loads(message)
-                        except json.JSONDecodeError:
-                            self.print_info("Otrzymano nieprawidłowy format JSON")
+                            data = loads(message)
+                        except decode_error:
+                            info("Otrzymano nieprawidłowy format JSON")
                             continue
                         
                         # Znajdź pojazd w danych
-                        vehicle = self.find_vehicle_in_data(data)
+                        vehicle = find(data)
                         if not vehicle:
-                            self.print_info(f"Nie znaleziono pojazdu o numerze {self.vehicle_id} w danych")
+                            info(f"Nie znaleziono pojazdu o numerze {self.vehicle_id} w danych")
                             continue
                         
                         # Wyciągnij pozycję
-                        position = self.extract_location(vehicle)
+                        position = extract(vehicle)
                         if position:
                             # Obsłuż aktualizację pozycji
-                            self.handle_position_update(position)
+                            handle(position)
                         
                     except websockets.exceptions.ConnectionClosed:
                         print("Połączenie z websocketem zostało zamknięte. Próba ponownego połączenia...")
@@ -1234,10 +1945,110 @@ class WebSocketTracker:
             #     self.map_visualizer.stop_auto_refresh()
             print("Zatrzymano śledzenie pojazdu.")
 
+# Skrypt strony mapy w trybie na żywo: łączy się z websocketem wizualizatora
+# i przesuwa jeden marker pojazdu zamiast przeładowywać całą stronę
+_LIVE_MAP_JS = string.Template("""
+    (function() {
+        var map = $map_name, vehicle = null, nearest = null, ws = null;
+        function sendVisibility() {
+            if (ws !== null && ws.readyState === WebSocket.OPEN) {
+                ws.send(JSON.stringify({visible: !document.hidden}));
+            }
+        }
+        // Ukryta karta nie dostaje pozycji - serwer nie wykonuje wtedy zbędnej pracy
+        document.addEventListener("visibilitychange", sendVisibility);
+        function connect() {
+            ws = new WebSocket("ws://localhost:$port/vehicle");
+            ws.onopen = function() { if (document.hidden) { sendVisibility(); } };
+            ws.onmessage = function(event) {
+                var v = JSON.parse(event.data);
+                var icon = L.AwesomeMarkers.icon({markerColor: v.color, iconColor: "white", icon: "bus", prefix: "fa"});
+                if (vehicle === null) {
+                    vehicle = L.marker([v.lat, v.lon], {icon: icon})
+                        .bindPopup(v.popup, {maxWidth: 300})
+                        .bindTooltip(v.tooltip, {sticky: true})
+                        .addTo(map);
+                } else {
+                    vehicle.setLatLng([v.lat, v.lon]).setIcon(icon).setPopupContent(v.popup).setTooltipContent(v.tooltip);
+                }
+                if (v.nearest) {
+                    if (nearest === null) {
+                        nearest = L.circleMarker(v.nearest, {radius: 5, color: "purple", fill: true, fillColor: "purple"})
+                            .bindTooltip("Najbliższy punkt na trasie", {sticky: true})
+                            .addTo(map);
+                    } else {
+                        nearest.setLatLng(v.nearest);
+                    }
+                }
+            };
+            ws.onclose = function() { setTimeout(connect, 2000); };
+        }
+        connect();
+    })();
+""")
+
+def _atomic_write(path, text):
+    """Zapisuje tekst do pliku tymczasowego i podmienia nim plik docelowy (bez częściowo zapisanych plików)."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def _atomic_write_gzip(path, text):
+    """Zapisuje tekst skompresowany gzipem (najszybszy poziom kompresji), podmieniając plik docelowy atomowo."""
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wb", compresslevel=1) as f:
+        f.write(text.encode("utf-8"))
+    os.replace(tmp_path, path)
+
+class VehicleState:
+    """Ostatni stan pojazdu wyświetlany na mapie (pola aktualizowane w miejscu przy każdej pozycji)."""
+    __slots__ = (
+        "latitude", "longitude", "heading", "speed", "line", "brigade", "timestamp",
+        "distance_from_start", "distance_to_route", "progress_percentage",
+        "previous_stop", "next_stop", "nearest_point_on_route"
+    )
+    
+    def update(self, position, result):
+        """Przepisuje pola z pozycji pojazdu i wyniku lokalizacji."""
+        self.latitude = position.lat
+        self.longitude = position.lon
+        self.heading = position.heading
+        self.speed = position.speed
+        self.line = position.line
+        self.brigade = position.brigade
+        self.timestamp = position.ts
+        self.distance_from_start = result['distance_from_start']
+        self.distance_to_route = result['distance_to_route']
+        self.progress_percentage = result['progress_percentage']
+        self.previous_stop = result['previous_stop']
+        self.next_stop = result['next_stop']
+        self.nearest_point_on_route = result['nearest_point_on_route']
+
+# Szablony HTML okienek popup (formatowane przez str.format_map)
+_STOP_POPUP_TEMPLATE = "<b>{name}</b><br>ID: {id}<br>Odległość od początku: {dist_from_start:.2f} m"
+_VEHICLE_POPUP_TEMPLATE = """
+        <div style="width: 200px;">
+            <h4>Pojazd: {line}/{brigade}</h4>
+            <p><b>Czas pomiaru:</b> {timestamp}</p>
+            <p><b>Prędkość:</b> {speed}</p>
+            <p><b>Odległość od trasy:</b> {distance_to_route:.1f} m</p>
+            <p><b>Postęp na trasie:</b> {progress_percentage:.1f}%</p>
+            <hr>
+            <p><b>Poprzedni przystanek:</b><br>{prev_stop_info}</p>
+            <p><b>Następny przystanek:</b><br>{next_stop_info}</p>
+            <p><i>Aktualizacja: {now}</i></p>
+        </div>
+        """
+
 class RouteMapVisualizer:
     """Klasa do wizualizacji trasy i pojazdu na mapie."""
     
-    def __init__(self, tracker, map_file_path="route_map.html", auto_open=True, auto_refresh=True):
+    # Tolerancja upraszczania linii trasy w stopniach (~1 m)
+    ROUTE_SIMPLIFY_TOLERANCE = 1e-5
+    
+    def __init__(self, tracker, map_file_path="route_map.html", auto_open=True, auto_refresh=True, live_port=None,
+                 gzip_output=False):
         """
         Inicjalizacja wizualizatora.
         
@@ -1245,47 +2056,103 @@ class RouteMapVisualizer:
             tracker: Instancja RouteTracker zawierająca dane o trasie i przystankach
             map_file_path: Ścieżka, gdzie ma być zapisany plik HTML z mapą
             auto_open: Czy automatycznie otworzyć mapę w przeglądarce
-            auto_refresh: Czy automatycznie odświeżać mapę
+            auto_refresh: Czy odświeżać mapę w tle (zapis pliku najwyżej raz na interwał)
+            live_port: Port websocketa, przez który strona otrzymuje pozycję pojazdu
+                       (None - pozycja jest zapisywana do pliku HTML przy każdej aktualizacji)
+            gzip_output: Czy zapisywać obok mapy jej wersję skompresowaną (map_file_path + ".gz")
+                         dla serwera HTTP udostępniającego wstępnie skompresowane pliki
         """
         self.tracker = tracker
+        
+        # Biblioteki mapy importowane dopiero tutaj - samo śledzenie w konsoli ich nie potrzebuje
+        import folium
+        from branca.element import Figure
+        self._folium = folium
+        self._Figure = Figure
+        
+        # Punkty trasy w kolejności [lat, lon] dla folium i centrum mapy - liczone raz
+        pts = np.fromiter(
+            (c for way in tracker.route_data if way.get("nodes") for node in way["nodes"] for c in node[:2]),
+            dtype=np.float64
+        ).reshape(-1, 2)
+        self._route_points_latlon = pts[:, ::-1]
+        if len(pts):
+            self._map_center = pts.mean(axis=0)[::-1].tolist()
+        else:
+            self._map_center = [52.2297, 21.0122]  # Warszawa jako domyślna lokalizacja
+        
+        # Uproszczona linia trasy do narysowania (Douglas-Peucker, tolerancja ~1 m)
+        # ze współrzędnymi zaokrąglonymi do 5 miejsc po przecinku
+        simplified = self._route_points_latlon
+        if len(simplified) >= 2:
+            simplified = np.asarray(
+                LineString(simplified).simplify(self.ROUTE_SIMPLIFY_TOLERANCE, preserve_topology=False).coords
+            )
+        self._route_points_simplified = np.round(simplified, 5).tolist()
+        
+        # Przystanki jako jedna kolekcja GeoJSON (nazwa i gotowy HTML popup we właściwościach)
+        stop_features = []
+        for stop in tracker.stops_data:
+            if stop.get("position"):
+                stop_name = stop.get("name", "Przystanek")
+                popup = _STOP_POPUP_TEMPLATE.format(
+                    name=stop_name, id=stop.get('id', 'N/A'), dist_from_start=stop.get('dist_from_start', 0)
+                )
+                stop_features.append({
+                    "type": "Feature",
+                    "geometry": {"type": "Point", "coordinates": [stop["position"][0], stop["position"][1]]},
+                    "properties": {"name": stop_name, "popup": popup}
+                })
+        self._stops_geojson = {"type": "FeatureCollection", "features": stop_features}
+        
         self.map_file_path = map_file_path
         self.auto_open = auto_open
         self.auto_refresh = auto_refresh
+        self.gzip_output = gzip_output
         self.vehicle_position = None
+        self._last_rendered_key = None
         self.map = None
         self.vehicle_marker = None
         self.last_update_time = None
         self.running = False
-        self.refresh_thread = None
+        # Zadanie odświeżające mapę i zdarzenie sygnalizujące nową pozycję pojazdu
+        self._refresh_task = None
+        self._dirty = None
+        self._io_executor = None
+        
+        # Serwer websocket dla strony mapy w trybie na żywo (_live_clients - tylko widoczne karty)
+        self.live_port = live_port
+        self._live_server = None
+        self._live_clients = set()
+        self._live_message = None
+        
+        # Statyczna część strony (trasa i przystanki) - budowana raz
+        self._static_html_prefix = ""
+        self._static_html_suffix = ""
         
         # Inicjalizacja mapy
         self.create_map()
     
     def create_map(self):
-        """Tworzy początkową mapę z trasą i przystankami."""
-        # Zbierz wszystkie punkty trasy do obliczenia centrum
-        all_points = []
-        for way in self.tracker.route_data:
-            if "nodes" in way and way["nodes"]:
-                for node in way["nodes"]:
-                    # W GeoJSON kolejność to [lon, lat], ale dla folium potrzebujemy [lat, lon]
-                    all_points.append((node[1], node[0]))
-        
-        # Jeśli nie ma punktów, użyj domyślnych współrzędnych
-        if not all_points:
-            center = [52.2297, 21.0122]  # Warszawa jako domyślna lokalizacja
-        else:
-            # Oblicz średnie współrzędne jako centrum mapy
-            avg_lat = sum(p[0] for p in all_points) / len(all_points)
-            avg_lon = sum(p[1] for p in all_points) / len(all_points)
-            center = [avg_lat, avg_lon]
+        """Tworzy początkową mapę z trasą i przystankami i otwiera ją w przeglądarce."""
+        self._build_static_map()
+        
+        # Zapisz mapę do pliku
+        self._write_map_file(self._static_html_prefix + self._static_html_suffix)
         
+        # Otwórz mapę w przeglądarce, jeśli opcja jest włączona
+        if self.auto_open:
+            import webbrowser
+            webbrowser.open('file://' + os.path.abspath(self.map_file_path))
+    
+    def _build_static_map(self):
+        """Buduje statyczną warstwę mapy (trasa i przystanki) i zapamiętuje wyrenderowany HTML."""
         # Stwórz figurę z określonymi wymiarami
-        fig = Figure(height='90%', width='100%')
+        fig = self._Figure(height='90%', width='100%')
         
         # Utwórz mapę
-        self.map = folium.Map(
-            location=center,
+        self.map = self._folium.Map(
+            location=self._map_center,
             zoom_start=13,
             tiles='OpenStreetMap'
         )
@@ -1297,28 +2164,29 @@ class RouteMapVisualizer:
         # Dodaj przystanki
         self._add_stops_to_map()
         
-        # Zapisz mapę do pliku
-        self.map.save(self.map_file_path)
-        
-        # Otwórz mapę w przeglądarce, jeśli opcja jest włączona
-        if self.auto_open:
-            webbrowser.open('file://' + os.path.abspath(self.map_file_path))
+        # Wyrenderuj stronę raz i podziel ją przed ostatnim </script>,
+        # żeby przy aktualizacji wstawiać tam tylko skrypt z markerami pojazdu
+        html = self.map.get_root().render()
+        split = html.rfind("</script>")
+        if split < 0:
+            split = len(html)
+        self._static_html_prefix = html[:split]
+        self._static_html_suffix = html[split:]
+        if self.live_port:
+            self._static_html_prefix += _LIVE_MAP_JS.substitute(map_name=self.map.get_name(), port=self.live_port)
+    
+    def _write_map_file(self, html):
+        """Zapisuje HTML mapy do pliku (i opcjonalnie jego wersję .gz)."""
+        _atomic_write(self.map_file_path, html)
+        if self.gzip_output:
+            _atomic_write_gzip(self.map_file_path + ".gz", html)
     
     def _add_route_to_map(self):
         """Dodaje linię trasy do mapy."""
-        route_points = []
-        
-        # Zbierz wszystkie punkty trasy w jedną listę
-        for way in self.tracker.route_data:
-            if "nodes" in way and way["nodes"]:
-                # Przekształć punkty z [lon, lat] na [lat, lon] dla folium
-                segment_points = [(node[1], node[0]) for node in way["nodes"]]
-                route_points.extend(segment_points)
-        
         # Dodaj linię trasy
-        if route_points:
-            folium.PolyLine(
-                route_points,
+        if self._route_points_simplified:
+            self._folium.PolyLine(
+                self._route_points_simplified,
                 color='blue',
                 weight=5,
                 opacity=0.7,
@@ -1326,22 +2194,18 @@ class RouteMapVisualizer:
             ).add_to(self.map)
     
     def _add_stops_to_map(self):
-        """Dodaje przystanki do mapy."""
-        for stop in self.tracker.stops_data:
-            if "position" in stop and stop["position"]:
-                # Przekształć punkt z [lon, lat] na [lat, lon] dla folium
-                stop_position = (stop["position"][1], stop["position"][0])
-                
-                # Pobierz nazwę przystanku
-                stop_name = stop.get("name", "Przystanek")
-                
-                # Dodaj marker przystanku
-                folium.Marker(
-                    stop_position,
-                    popup=f"<b>{stop_name}</b><br>ID: {stop.get('id', 'N/A')}<br>Odległość od początku: {stop.get('dist_from_start', 0):.2f} m",
-                    tooltip=stop_name,
-                    icon=folium.Icon(color='green', icon='bus', prefix='fa')
-                ).add_to(self.map)
+        """Dodaje przystanki do mapy jako jedną warstwę GeoJSON."""
+        if not self._stops_geojson["features"]:
+            return
+        
+        folium = self._folium
+        folium.GeoJson(
+            self._stops_geojson,
+            name='Przystanki',
+            marker=folium.Marker(icon=folium.Icon(color='green', icon='bus', prefix='fa')),
+            tooltip=folium.GeoJsonTooltip(fields=['name'], labels=False),
+            popup=folium.GeoJsonPopup(fields=['popup'], labels=False)
+        ).add_to(self.map)
     
     def update_vehicle_position(self, position, result):
         """
@@ -1357,190 +2221,316 @@ class RouteMapVisualizer:
         # Aktualizuj czas ostatniej aktualizacji
         self.last_update_time = time.time()
         
-        # Zapisz pozycję pojazdu
-        self.vehicle_position = {
-            'latitude': position['latitude'],
-            'longitude': position['longitude'],
-            'heading': position.get('heading', 0),
-            'speed': position.get('speed', 0),
-            'line': position.get('line', 'N/A'),
-            'brigade': position.get('brigade', 'N/A'),
-            'timestamp': position.get('timestamp', None),
-            'distance_from_start': result['distance_from_start'],
-            'distance_to_route': result['distance_to_route'],
-            'progress_percentage': result['progress_percentage'],
-            'previous_stop': result['previous_stop'],
-            'next_stop': result['next_stop'],
-            'nearest_point_on_route': result['nearest_point_on_route']
-        }
+        # Zapisz pozycję pojazdu (obiekt stanu tworzony raz i aktualizowany w miejscu)
+        if self.vehicle_position is None:
+            self.vehicle_position = VehicleState()
+        self.vehicle_position.update(position, result)
+        
+        # Nie odświeżaj mapy, jeśli pojazd nie zmienił widocznie położenia (np. stoi na światłach)
+        render_key = (round(position.lat, 6), round(position.lon, 6), round(result['distance_to_route'], 1))
+        if render_key == self._last_rendered_key:
+            return
+        self._last_rendered_key = render_key
         
-        # Zaktualizuj mapę
-        self._update_map()
+        # Przy włączonym odświeżaniu tylko oznacz mapę do aktualizacji - seria pozycji
+        # w krótkim czasie kończy się jednym zapisem pliku
+        if self._dirty is not None:
+            self._dirty.set()
+        else:
+            self._update_map()
     
     def _create_vehicle_popup(self):
         """Tworzy zawartość popup dla markera pojazdu."""
         position = self.vehicle_position
-        timestamp = datetime.fromtimestamp(position['timestamp']).strftime('%H:%M:%S') if position.get('timestamp') else 'N/A'
+        timestamp = time.strftime('%H:%M:%S', time.localtime(position.timestamp)) if position.timestamp else 'N/A'
         
         # Przygotuj informacje o przystankach
         prev_stop_info = "Brak danych"
         next_stop_info = "Brak danych"
         
-        if position.get('previous_stop'):
-            prev = position['previous_stop']
+        if position.previous_stop:
+            prev = position.previous_stop
             prev_name = prev.get('name', 'Brak nazwy')
             prev_stop_info = f"{prev_name} ({prev['distance_to_current']:.0f} m temu)"
         
-        if position.get('next_stop'):
-            next_s = position['next_stop']
+        if position.next_stop:
+            next_s = position.next_stop
             next_name = next_s.get('name', 'Brak nazwy')
             next_stop_info = f"{next_name} (za {next_s['distance_from_current']:.0f} m)"
         
-        # Stwórz zawartość HTML dla popup
-        popup_content = f"""
-        <div style="width: 200px;">
-            <h4>Pojazd: {position.get('line', 'N/A')}/{position.get('brigade', 'N/A')}</h4>
-            <p><b>Czas pomiaru:</b> {timestamp}</p>
-            <p><b>Prędkość:</b> {position.get('speed', 0):.1f} km/h</p>
-            <p><b>Odległość od trasy:</b> {position['distance_to_route']:.1f} m</p>
-            <p><b>Postęp na trasie:</b> {position['progress_percentage']:.1f}%</p>
-            <hr>
-            <p><b>Poprzedni przystanek:</b><br>{prev_stop_info}</p>
-            <p><b>Następny przystanek:</b><br>{next_stop_info}</p>
-            <p><i>Aktualizacja: {datetime.now().strftime('%H:%M:%S')}</i></p>
-        </div>
-        """
-        return popup_content
+        return _VEHICLE_POPUP_TEMPLATE.format_map({
+            'line': position.line,
+            'brigade': position.brigade,
+            'timestamp': timestamp,
+            'speed': f"{position.speed:.1f} km/h" if isinstance(position.speed, (int, float)) else "N/A",
+            'distance_to_route': position.distance_to_route,
+            'progress_percentage': position.progress_percentage,
+            'prev_stop_info': prev_stop_info,
+            'next_stop_info': next_stop_info,
+            'now': time.strftime('%H:%M:%S')
+        })
+    
+    @staticmethod
+    def _vehicle_color(distance_to_route):
+        """Zwraca kolor markera pojazdu na podstawie odległości od trasy."""
+        if distance_to_route < 20:
+            return 'red'  # Na trasie
+        if distance_to_route < 50:
+            return 'orange'  # Blisko trasy
+        return 'darkred'  # Daleko od trasy
+    
+    def _render_vehicle_fragment(self, position):
+        """Zwraca skrypt JS dodający do mapy marker pojazdu i najbliższy punkt na trasie."""
+        color = self._vehicle_color(position.distance_to_route)
+        map_name = self.map.get_name()
+        icon = json.dumps({"markerColor": color, "iconColor": "white", "icon": "bus", "prefix": "fa"})
+        popup = json.dumps(self._create_vehicle_popup(), ensure_ascii=False)
+        tooltip = json.dumps(f"Pojazd {position.line}/{position.brigade}", ensure_ascii=False)
+        
+        fragment = (
+            f"\n    var vehicle_marker = L.marker([{position.latitude}, {position.longitude}], "
+            f"{{icon: L.AwesomeMarkers.icon({icon})}})"
+            f".bindPopup({popup}, {{maxWidth: 300}})"
+            f".bindTooltip({tooltip}, {{sticky: true}})"
+            f".addTo({map_name});\n"
+        )
+        
+        # Marker najbliższego punktu na trasie ([lon, lat] -> [lat, lon])
+        nearest = position.nearest_point_on_route
+        if nearest:
+            fragment += (
+                f"    var nearest_point_marker = L.circleMarker([{nearest[1]}, {nearest[0]}], "
+                f"{{radius: 5, color: 'purple', fill: true, fillColor: 'purple'}})"
+                f".bindTooltip('Najbliższy punkt na trasie', {{sticky: true}})"
+                f".addTo({map_name});\n"
+            )
+        return fragment
     
     def _update_map(self):
-        """Aktualizuje mapę z nową pozycją pojazdu."""
+        """Aktualizuje mapę z nową pozycją pojazdu (bez przebudowy trasy i przystanków)."""
         if not self.vehicle_position:
             return
         
-        # Utwórz nową mapę
-        self.create_map()
-        
-        # Dodaj marker pojazdu
-        popup_content = self._create_vehicle_popup()
-        
-        # Określ kolor markera na podstawie odległości od trasy
-        if self.vehicle_position['distance_to_route'] < 20:
-            color = 'red'  # Na trasie
-        elif self.vehicle_position['distance_to_route'] < 50:
-            color = 'orange'  # Blisko trasy
-        else:
-            color = 'darkred'  # Daleko od trasy
-        
-        # Dodaj marker pojazdu
-        folium.Marker(
-            [self.vehicle_position['latitude'], self.vehicle_position['longitude']],
-            popup=folium.Popup(popup_content, max_width=300),
-            tooltip=f"Pojazd {self.vehicle_position.get('line', 'N/A')}/{self.vehicle_position.get('brigade', 'N/A')}",
-            icon=folium.Icon(color=color, icon='bus', prefix='fa')
-        ).add_to(self.map)
-        
-        # Dodaj marker najbliższego punktu na trasie
-        if 'nearest_point_on_route' in self.vehicle_position:
-            nearest = self.vehicle_position['nearest_point_on_route']
-            folium.CircleMarker(
-                [nearest[1], nearest[0]],  # Zamień [lon, lat] na [lat, lon]
-                radius=5,
-                color='purple',
-                fill=True,
-                fill_color='purple',
-                tooltip='Najbliższy punkt na trasie'
-            ).add_to(self.map)
+        # W trybie na żywo wyślij pozycję do otwartych stron zamiast zapisywać plik
+        if self._live_server is not None:
+            self._broadcast_vehicle(self.vehicle_position)
+            return
         
-        # Zapisz mapę do pliku
-        self.map.save(self.map_file_path)
+        self._write_map_file(self._render_map_html())
+    
+    def _render_map_html(self):
+        """Zwraca pełny HTML mapy z aktualną pozycją pojazdu."""
+        return (
+            self._static_html_prefix
+            + self._render_vehicle_fragment(self.vehicle_position)
+            + self._static_html_suffix
+        )
+    
+    def _broadcast_vehicle(self, position):
+        """Wysyła pozycję pojazdu do wszystkich widocznych stron mapy połączonych przez websocket."""
+        self._live_message = None
+        # Żadna karta z mapą nie jest widoczna - wiadomość zostanie zbudowana, gdy któraś się pokaże
+        if not self._live_clients:
+            return
+        websockets.broadcast(self._live_clients, self._current_live_message())
+    
+    def _current_live_message(self):
+        """Zwraca (budując w razie potrzeby) wiadomość JSON z ostatnią pozycją pojazdu lub None."""
+        position = self.vehicle_position
+        if self._live_message is None and position:
+            nearest = position.nearest_point_on_route
+            self._live_message = json.dumps({
+                "lat": position.latitude,
+                "lon": position.longitude,
+                "color": self._vehicle_color(position.distance_to_route),
+                "popup": self._create_vehicle_popup(),
+                "tooltip": f"Pojazd {position.line}/{position.brigade}",
+                "nearest": [nearest[1], nearest[0]] if nearest else None
+            })
+        return self._live_message
+    
+    async def _live_handler(self, websocket, *args):
+        """
+        Obsługuje połączenie strony mapy: wysyła ostatnią pozycję i odbiera informacje o widoczności karty.
+        Do ukrytych kart pozycje nie są wysyłane - po ponownym pokazaniu karta dostaje od razu ostatnią pozycję.
+        """
+        self._live_clients.add(websocket)
+        try:
+            message = self._current_live_message()
+            if message is not None:
+                await websocket.send(message)
+            async for frame in websocket:
+                try:
+                    visible = json.loads(frame).get("visible", True)
+                except (ValueError, AttributeError):
+                    continue
+                if not visible:
+                    self._live_clients.discard(websocket)
+                elif websocket not in self._live_clients:
+                    self._live_clients.add(websocket)
+                    message = self._current_live_message()
+                    if message is not None:
+                        await websocket.send(message)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self._live_clients.discard(websocket)
+    
+    async def start_live_server(self):
+        """Uruchamia serwer websocket przekazujący pozycję pojazdu do strony mapy."""
+        if not self.live_port or self._live_server is not None:
+            return
+        self._live_server = await websockets.serve(self._live_handler, "localhost", self.live_port)
+    
+    async def stop_live_server(self):
+        """Zatrzymuje serwer websocket strony mapy."""
+        if self._live_server is not None:
+            self._live_server.close()
+            await self._live_server.wait_closed()
+            self._live_server = None
     
     def start_auto_refresh(self, interval=5):
         """
-        Rozpoczyna automatyczne odświeżanie mapy.
+        Rozpoczyna automatyczne odświeżanie mapy w bieżącej pętli zdarzeń.
         
         Args:
             interval: Interwał odświeżania w sekundach
         """
-        if not self.auto_refresh:
+        # W trybie na żywo strona dostaje każdą pozycję od razu przez websocket
+        if not self.auto_refresh or self._live_server is not None:
             return
         
         self.running = True
-        
-        def refresh_loop():
-            while self.running:
-                time.sleep(interval)
-                if self.vehicle_position:
-                    self._update_map()
-        
-        self.refresh_thread = threading.Thread(target=refresh_loop)
-        self.refresh_thread.daemon = True
-        self.refresh_thread.start()
+        if self._io_executor is None:
+            self._io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._dirty = asyncio.Event()
+        self._refresh_task = asyncio.ensure_future(self._refresh_worker(interval))
+    
+    async def _refresh_worker(self, interval):
+        """Zapisuje mapę po każdej nowej pozycji pojazdu, nie częściej niż raz na interval sekund."""
+        dirty = self._dirty
+        loop = asyncio.get_event_loop()
+        while self.running:
+            await dirty.wait()
+            dirty.clear()
+            if self._live_server is not None:
+                self._update_map()
+            elif self.vehicle_position:
+                # Zapis pliku w osobnym wątku, żeby nie blokować pętli zdarzeń
+                await loop.run_in_executor(self._io_executor, self._write_map_file, self._render_map_html())
+            await asyncio.sleep(interval)
     
     def stop_auto_refresh(self):
         """Zatrzymuje automatyczne odświeżanie mapy."""
         self.running = False
-        if self.refresh_thread:
-            self.refresh_thread.join(timeout=1.0)
+        self._dirty = None
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self._io_executor is not None:
+            self._io_executor.shutdown(wait=False)
+            self._io_executor = None
+
+# Sekwencja ANSI: kursor na początek ekranu i wyczyszczenie ekranu
+_ANSI_CLEAR = "\x1b[H\x1b[2J"
+# Czy konsola obsługuje sekwencje ANSI (None - jeszcze nie sprawdzono)
+_ansi_console = None
+
+def _enable_windows_vt_mode():
+    """Włącza obsługę sekwencji ANSI w konsoli Windows. Zwraca True, jeśli się udało."""
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11)  # STD_OUTPUT_HANDLE
+        mode = ctypes.c_uint32()
+        if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            return False
+        # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+        return bool(kernel32.SetConsoleMode(handle, mode.value | 0x0004))
+    except Exception:
+        return False
+
+def _console_clear_sequence():
+    """
+    Zwraca sekwencję czyszczącą konsolę, którą można wypisać razem z resztą tekstu.
+    W konsoli bez obsługi ANSI czyści ją od razu poleceniem systemowym i zwraca pusty napis.
+    """
+    global _ansi_console
+    if _ansi_console is None:
+        _ansi_console = os.name != 'nt' or _enable_windows_vt_mode()
+    
+    if _ansi_console:
+        # Sekwencja ANSI zamiast uruchamiania zewnętrznego polecenia przy każdej aktualizacji
+        return _ANSI_CLEAR
+    os.system('cls')
+    return ""
 
-def clear_console():
-    """Czyści konsolę."""
-    # Dla różnych systemów operacyjnych
-    os.system('cls' if os.name == 'nt' else 'clear')
+def write_lines(lines, clear=False):
+    """
+    Wypisuje zebrane wiersze jednym zapisem na standardowe wyjście (zamiast osobnego print dla każdego wiersza).
+    Przy clear=True sekwencja czyszcząca konsolę trafia do tego samego zapisu - bez migotania ekranu.
+    """
+    prefix = _console_clear_sequence() if clear else ""
+    sys.stdout.write(prefix + "\n".join(lines) + "\n")
+    sys.stdout.flush()
 
 def pretty_print_result(result):
     """Wyświetla wynik w czytelnej formie."""
-    print("\n--- INFORMACJE O POZYCJI NA TRASIE ---")
+    lines = []
+    out = lines.append
+    
+    out("\n--- INFORMACJE O POZYCJI NA TRASIE ---")
     lat, lon = result['location'][1], result['location'][0]  # Odwrócona kolejność dla wyświetlania
     nearest_lat, nearest_lon = result['nearest_point_on_route'][1], result['nearest_point_on_route'][0]
-    print(f"Aktualna lokalizacja (lat, lon): ({lat}, {lon})")
-    print(f"Najbliższy punkt na trasie (lat, lon): ({nearest_lat}, {nearest_lon})")
-    print(f"Odległość od początku trasy: {result['distance_from_start']:.2f} m")
-    print(f"Odległość od trasy: {result['distance_to_route']:.2f} m")
-    print(f"Całkowita długość trasy: {result['total_route_length']:.2f} m")
-    print(f"Postęp na trasie: {result['progress_percentage']:.2f}%")
+    out(f"Aktualna lokalizacja (lat, lon): ({lat}, {lon})")
+    out(f"Najbliższy punkt na trasie (lat, lon): ({nearest_lat}, {nearest_lon})")
+    out(f"Odległość od początku trasy: {result['distance_from_start']:.2f} m")
+    out(f"Odległość od trasy: {result['distance_to_route']:.2f} m")
+    out(f"Całkowita długość trasy: {result['total_route_length']:.2f} m")
+    out(f"Postęp na trasie: {result['progress_percentage']:.2f}%")
     
     # Informacje o segmencie
     if result['segment_info']:
         segment = result['segment_info']
-        print("\n--- INFORMACJE O SEGMENCIE ---")
-        print(f"Segment nr: {segment['segment_index'] + 1}")
-        print(f"ID segmentu: {segment['segment_id']}")
-        print(f"Węzeł początkowy: {segment['start_node']}")
-        print(f"Węzeł końcowy: {segment['end_node']}")
-        print(f"Pozycja w segmencie: {segment['distance_in_segment']:.2f} m / {segment['segment_length']:.2f} m ({segment['segment_percentage']:.2f}%)")
+        out("\n--- INFORMACJE O SEGMENCIE ---")
+        out(f"Segment nr: {segment['segment_index'] + 1}")
+        out(f"ID segmentu: {segment['segment_id']}")
+        out(f"Węzeł początkowy: {segment['start_node']}")
+        out(f"Węzeł końcowy: {segment['end_node']}")
+        out(f"Pozycja w segmencie: {segment['distance_in_segment']:.2f} m / {segment['segment_length']:.2f} m ({segment['segment_percentage']:.2f}%)")
         if 'warning' in segment:
-            print(f"UWAGA: {segment['warning']}")
+            out(f"UWAGA: {segment['warning']}")
     
     # Informacje o przystankach
-    print("\n--- INFORMACJE O PRZYSTANKACH ---")
+    out("\n--- INFORMACJE O PRZYSTANKACH ---")
     
     if result['previous_stop']:
         prev = result['previous_stop']
         prev_lat, prev_lon = prev['position'][1], prev['position'][0]  # Odwrócona kolejność dla wyświetlania
         prev_name = prev.get('name', 'Brak nazwy')  # Pobierz nazwę przystanku
-        print(f"Poprzedni przystanek:")
-        print(f"  ID: {prev['id']}")
-        print(f"  Nazwa: {prev_name}")
-        print(f"  Typ: {prev['role']}")
-        print(f"  Pozycja (lat, lon): ({prev_lat}, {prev_lon})")
-        print(f"  Odległość od początku trasy: {prev['distance_from_start']:.2f} m")
-        print(f"  Odległość za nami: {prev['distance_to_current']:.2f} m")
+        out(f"Poprzedni przystanek:")
+        out(f"  ID: {prev['id']}")
+        out(f"  Nazwa: {prev_name}")
+        out(f"  Typ: {prev['role']}")
+        out(f"  Pozycja (lat, lon): ({prev_lat}, {prev_lon})")
+        out(f"  Odległość od początku trasy: {prev['distance_from_start']:.2f} m")
+        out(f"  Odległość za nami: {prev['distance_to_current']:.2f} m")
     else:
-        print("Brak poprzedniego przystanku (jesteśmy na początku trasy)")
+        out("Brak poprzedniego przystanku (jesteśmy na początku trasy)")
     
     if result['next_stop']:
         next_s = result['next_stop']
         next_lat, next_lon = next_s['position'][1], next_s['position'][0]  # Odwrócona kolejność dla wyświetlania
         next_name = next_s.get('name', 'Brak nazwy')  # Pobierz nazwę przystanku
-        print(f"Następny przystanek:")
-        print(f"  ID: {next_s['id']}")
-        print(f"  Nazwa: {next_name}")
-        print(f"  Typ: {next_s['role']}")
-        print(f"  Pozycja (lat, lon): ({next_lat}, {next_lon})")
-        print(f"  Odległość od początku trasy: {next_s['distance_from_start']:.2f} m")
-        print(f"  Odległość przed nami: {next_s['distance_from_current']:.2f} m")
+        out(f"Następny przystanek:")
+        out(f"  ID: {next_s['id']}")
+        out(f"  Nazwa: {next_name}")
+        out(f"  Typ: {next_s['role']}")
+        out(f"  Pozycja (lat, lon): ({next_lat}, {next_lon})")
+        out(f"  Odległość od początku trasy: {next_s['distance_from_start']:.2f} m")
+        out(f"  Odległość przed nami: {next_s['distance_from_current']:.2f} m")
     else:
-        print("Brak następnego przystanku (jesteśmy na końcu trasy)")
+        out("Brak następnego przystanku (jesteśmy na końcu trasy)")
         
     # Podsumowanie pozycji między przystankami
     if result['previous_stop'] and result['next_stop']:
@@ -1552,11 +2542,21 @@ def pretty_print_result(result):
         current_distance_from_prev = result['distance_from_start'] - prev_stop['distance_from_start']
         progress_between_stops = (current_distance_from_prev / total_distance_between_stops * 100) if total_distance_between_stops > 0 else 0
         
-        print("\n--- POZYCJA POMIĘDZY PRZYSTANKAMI ---")
-        print(f"Przystanki: {prev_name} → {next_name}")
-        print(f"Odległość między przystankami: {total_distance_between_stops:.2f} m")
-        print(f"Odległość przebyta od poprzedniego przystanku: {current_distance_from_prev:.2f} m")
-        print(f"Postęp między przystankami: {progress_between_stops:.2f}%")
+        out("\n--- POZYCJA POMIĘDZY PRZYSTANKAMI ---")
+        out(f"Przystanki: {prev_name} → {next_name}")
+        out(f"Odległość między przystankami: {total_distance_between_stops:.2f} m")
+        out(f"Odległość przebyta od poprzedniego przystanku: {current_distance_from_prev:.2f} m")
+        out(f"Postęp między przystankami: {progress_between_stops:.2f}%")
+    
+    write_lines(lines)
+
+def run_event_loop(coro):
+    """Uruchamia korutynę w pętli zdarzeń uvloop, jeśli jest dostępna, a w przeciwnym razie w standardowej pętli asyncio."""
+    if uvloop is not None:
+        if hasattr(uvloop, "run"):
+            return uvloop.run(coro)
+        uvloop.install()
+    return asyncio.run(coro)
 
 async def run_websocket_tracker(tracker, websocket_url, vehicle_id, update_interval=1.0, verbose=False):
     """Uruchamia śledzenie pojazdu za pomocą WebSocket."""
@@ -1590,12 +2590,15 @@ def main():
                         help='Interwał aktualizacji (w sekundach, domyślnie: 1.0)')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Włącza tryb gadatliwy (więcej informacji diagnostycznych)')
+    parser.add_argument('--cache-dir',
+                        help='Katalog, w którym zapamiętywane są wyniki lokalizacji między uruchomieniami (domyślnie: brak)')
     
     args = parser.parse_args()
     
+    tracker = None
     try:
         print("Inicjalizowanie RouteTracker...")
-        tracker = RouteTracker(args.route_file, args.stops_file, args.verbose)
+        tracker = RouteTracker(args.route_file, args.stops_file, args.verbose, args.cache_dir)
         print("Inicjalizacja zakończona!")
         
         print(f"Rozpoczynam śledzenie pojazdu o numerze: {args.vehicle_id}")
@@ -1604,7 +2607,7 @@ def main():
         print("Naciśnij Ctrl+C, aby zakończyć...")
         
         # Uruchom śledzenie WebSocket
-        asyncio.run(run_websocket_tracker(
+        run_event_loop(run_websocket_tracker(
             tracker=tracker,
             websocket_url=args.websocket,
             vehicle_id=args.vehicle_id,
@@ -1618,6 +2621,9 @@ def main():
             import traceback
             traceback.print_exc()
         return 1
+    finally:
+        if tracker is not None:
+            tracker.close()
     
     return 0
 